@@ -1,19 +1,40 @@
 from json import load
-from multiprocessing import Manager, Process
+from multiprocessing import Process
 from os import path
+from time import monotonic_ns
 import wx
 
-from util.led import DashLEDController
+from util.data_packet import DataPacket
+from util.delta import LapDelta
+from util.latency import latency_name, LatencyStats, STAGES
+from util.led import LEDRenderLoop
 from util.telemetry import Telemetry
-from util.ui import UIElements
+from util.ring_buffer import LatestPacketSlot, PacketRingBuffer
+from util.ui import UIElements, WidgetRenderer
 from workers.dashboard_background import worker
 
+# Packet fields shown on (or needed to calculate values for) the dashboard
+DASHBOARD_FIELDS = [
+    'active', 'speed', 'gear_num', 'fuel', 'dist_traveled',
+    'lap_time_current', 'lap_time_last', 'lap_num', 'race_position',
+    'car_class_id', 'tire_temp_FL', 'tire_temp_FR', 'tire_temp_RL', 'tire_temp_RR',
+    # Used to find the reference lap for the time gain
+    'car_ordinal_id', 'position_x', 'position_z'
+]
+
 class DashboardFrame(wx.Frame):
     def __init__(self, *args, **kwds):
-        # Instantiate utility classes
+        # Instantiate utility classes (only decoding the fields we use)
         self.ui = UIElements()
-        self.telemetry = Telemetry()
-        self.led_controller = DashLEDController(self.telemetry)
+        self.packet = DataPacket(version=config['version'], fields=DASHBOARD_FIELDS)
+        self.telemetry = Telemetry(
+            color_maps=config.get('tire_temperature', {}),
+            lap_delta=LapDelta(config.get('reference_dir', 'references'))
+        )
+
+        # Update the LEDs at packet rate from their own thread
+        self.led_loop = LEDRenderLoop(ring.name, config['version'], coalesce)
+        self.led_loop.start()
 
         # Setup initial style and frame properties
         kwds["style"] = kwds.get("style", 0) | wx.DEFAULT_FRAME_STYLE | wx.STAY_ON_TOP
@@ -55,67 +76,118 @@ class DashboardFrame(wx.Frame):
         self.ui.draw_lap_time_elements(self)
         self.ui.draw_lap_and_position_elements(self)
 
+        # Draw the latency overlay (toggled with F9)
+        self.ui.draw_latency_overlay(self, main_sizer)
+
         # Re-size the screen as needed after elements are populated
         self.main_panel.SetSizer(main_sizer)
         self.Layout()
 
+        # Track rendered values so unchanged widgets are skipped
+        self.renderer = WidgetRenderer(self)
+
+        # Latency window and overlay timing (in monotonic_ns)
+        self._last_update = 0
+        self._window_start = monotonic_ns()
+        self._overlay_updated = 0
+
     def update(self, _):
-        # Load a copy of the data so we know when it changes
-        self.telemetry.load(dashboard_data.copy())
+        # Count any timer ticks missed since the last update as dropped frames
+        now = monotonic_ns()
+        dropped = 0
+        if self._last_update:
+            dropped = max(0, (now - self._last_update) // self._update_ns - 1)
+        self._last_update = now
+
+        # Load each packet received since the last update (only the
+        # newest packet is decoded when coalescing)
+        received = []
+        for packet in ring.read_new():
+            parse_start = monotonic_ns()
+            record = self.packet.decode(packet)
+            latency.record('parse', parse_start)
+            self.telemetry.load(record._asdict())
+            received.append(ring.timestamp)
+        dashboard_data = self.telemetry.data
 
         # Ensure at least one packet has been parsed
         if len(dashboard_data.keys()) == 0 or not dashboard_data['active']:
-            # Turn off any LEDs and stop logic
-            self.led_controller.clear_status()
             return
 
-        # Update LED Controller status
-        self.led_controller.update_status()
-
-        tire_temp = self.telemetry.tire_temperature
+        fl_temp, fl_color, fr_temp, fr_color, rl_temp, rl_color, rr_temp, rr_color = self.telemetry.tire_temperature
         # Tire Temp FL
-        fl_tire = tire_temp['FL']
-        self.tire_temp_FL.SetLabel(str(round(fl_tire['value'])))
-        self.tire_temp_FL.SetForegroundColour(wx.Colour(fl_tire['color']))
+        self.renderer.set_label(self.tire_temp_FL, str(round(fl_temp)))
+        self.renderer.set_colour(self.tire_temp_FL, fl_color)
 
         # Tire Temp FR
-        fr_tire = tire_temp['FR']
-        self.tire_temp_FR.SetLabel(str(round(fr_tire['value'])))
-        self.tire_temp_FR.SetForegroundColour(wx.Colour(fr_tire['color']))
+        self.renderer.set_label(self.tire_temp_FR, str(round(fr_temp)))
+        self.renderer.set_colour(self.tire_temp_FR, fr_color)
 
         # Tire Temp RL
-        rl_tire = tire_temp['RL']
-        self.tire_temp_RL.SetLabel(str(round(rl_tire['value'])))
-        self.tire_temp_RL.SetForegroundColour(wx.Colour(rl_tire['color']))
+        self.renderer.set_label(self.tire_temp_RL, str(round(rl_temp)))
+        self.renderer.set_colour(self.tire_temp_RL, rl_color)
 
         # Tire Temp RR
-        rr_tire = tire_temp['RR']
-        self.tire_temp_RR.SetLabel(str(round(rr_tire['value'])))
-        self.tire_temp_RR.SetForegroundColour(wx.Colour(rr_tire['color']))
+        self.renderer.set_label(self.tire_temp_RR, str(round(rr_temp)))
+        self.renderer.set_colour(self.tire_temp_RR, rr_color)
 
         # Update Speed & Gear
-        self.speed_value.SetLabel(str(dashboard_data['speed']))
-        self.gear_num_value.SetLabel(str(self.telemetry.gear))
+        self.renderer.set_label(self.speed_value, str(dashboard_data['speed']))
+        self.renderer.set_label(self.gear_num_value, str(self.telemetry.gear))
 
         # Update Fuel level values
-        self.total_fuel_value.SetLabel(self.telemetry.fuel_level)
-        self.fuel_per_lap_value.SetLabel(self.telemetry.fuel_percent_per_lap)
+        self.renderer.set_label(self.total_fuel_value, self.telemetry.fuel_level)
+        self.renderer.set_label(self.fuel_per_lap_value, self.telemetry.fuel_percent_per_lap)
 
         # Set Lap Time/Time Gain
-        self.lap_time_value.SetLabel(self.telemetry.lap_time)
+        self.renderer.set_label(self.lap_time_value, self.telemetry.lap_time)
         time_gain = self.telemetry.time_gain
-        self.time_gain_value.SetLabel(time_gain['value'])
-        self.time_gain_value.SetForegroundColour(time_gain['color'])
+        self.renderer.set_label(self.time_gain_value, time_gain['value'])
+        self.renderer.set_colour(self.time_gain_value, time_gain['color'])
 
         # Set Lap Number & Position
-        self.lap_num_value.SetLabel(str(dashboard_data['lap_num'] + 1))
-        self.position_value.SetLabel(str(dashboard_data['race_position']))
+        self.renderer.set_label(self.lap_num_value, str(dashboard_data['lap_num'] + 1))
+        self.renderer.set_label(self.position_value, str(dashboard_data['race_position']))
+
+        # Refresh the latency overlay once a second while it is shown
+        if self.latency_value.IsShown() and now - self._overlay_updated >= 1e9:
+            self.renderer.set_label(self.latency_value, self._latency_overlay_text())
+            self._overlay_updated = now
+
+        # Only repaint the widgets which changed
+        self.renderer.render()
+
+        # Record how long each packet took to reach the screen
+        painted = monotonic_ns()
+        for timestamp in received:
+            if timestamp:
+                latency.record('paint', timestamp, painted)
+        latency.frame(dropped)
+
+        # Start a new latency window every 10 seconds
+        if painted - self._window_start >= 10e9:
+            latency.roll()
+            self._window_start = painted
+
+    def toggle_latency_overlay(self):
+        '''Show or hide the latency overlay'''
+        self.latency_value.Show(not self.latency_value.IsShown())
+        self._overlay_updated = 0
+        self.main_panel.Layout()
+
+    def _latency_overlay_text(self):
+        '''Format the latency percentiles and drop counters for the overlay'''
+        summary = latency.summary()
+        stages = [f"{stage} p50 {summary[stage]['p50_ms']}ms p99 {summary[stage]['p99_ms']}ms" for stage in STAGES]
+        dropped_packets = getattr(ring, 'dropped', 0)
+        return '  '.join(stages) + f"  dropped frames {summary['dropped_frames']}  packets {dropped_packets}"
 
     def _start_timer(self, update_in_ms = 50):
         '''Start the update timer to refresh values on the UI'''
         self.timer = wx.Timer(self)
         self.Bind(wx.EVT_TIMER, self.update, self.timer)
         self.timer.Start(update_in_ms)
+        self._update_ns = update_in_ms * 1000000
 
     def _set_window_properties(self):
         '''Set the core window properties such as title, size, background, etc.'''
@@ -147,6 +219,9 @@ class DashboardApp(wx.App):
         # Get the key code for the key pressed
         key_code = self._get_key_code(event)
 
+        # Latency overlay
+        if key_code == wx.WXK_F9:
+            self.dashboard_frame.toggle_latency_overlay()
         # Clear stints
         if key_code == wx.WXK_F10:
             self.dashboard_frame.telemetry.clear_stints()
@@ -156,8 +231,13 @@ class DashboardApp(wx.App):
             self.dashboard_frame.ShowFullScreen(self.maximized, style=wx.FULLSCREEN_ALL)
         # Exiting
         elif key_code == wx.WXK_ESCAPE:
+            self.dashboard_frame.led_loop.stop()
             self.dashboard_frame.Close()
             worker_process.terminate()
+            ring.close()
+            ring.unlink()
+            latency.close()
+            latency.unlink()
             exit(0)
 
     def _get_key_code(self, event):
@@ -168,23 +248,27 @@ class DashboardApp(wx.App):
         # Special characters
         return event.GetKeyCode()
 
-with Manager() as manager:
-    # Create shared dict for the worker and UI to use
-    dashboard_data = manager.dict({})
+# Load the configuration for the worker
+if not path.isfile('config.json'):
+    raise Exception('config.json file is missing - please follow setup instructions.')
+with open("config.json", "r") as f:
+    config = load(f)
+
+# Create a shared ring buffer for the worker and UI to use, or a single
+# slot holding only the newest packet if coalescing is enabled
+coalesce = config.get('coalesce', False)
+ring = LatestPacketSlot(create=True) if coalesce else PacketRingBuffer(create=True)
 
-    # Create the base app
-    app = DashboardApp()
+# Create the shared latency statistics (see: tools.py latency)
+latency = LatencyStats(latency_name(config['port']), create=True)
 
-    # Load the configuration for the worker
-    if not path.isfile('config.json'):
-        raise Exception('config.json file is missing - please follow setup instructions.')
-    with open("config.json", "r") as f:
-        config = load(f)
+# Create the base app
+app = DashboardApp()
 
-    # Start the background worker process
-    args = (dashboard_data, config['version'], config['host'], config['port'])
-    worker_process = Process(target=worker, args=args)
-    worker_process.start()
+# Start the background worker process
+args = (ring.name, config['version'], config['host'], config['port'], coalesce, latency.name)
+worker_process = Process(target=worker, args=args)
+worker_process.start()
 
-    # Run the main wx loop
-    app.MainLoop()
+# Run the main wx loop
+app.MainLoop()
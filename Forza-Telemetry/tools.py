@@ -1,14 +1,32 @@
+import asyncio
 import click
 import gzip
-from json import dumps
-from multiprocessing import Manager, Process
+from json import dumps, loads
+from multiprocessing import cpu_count, Event, Process, Queue
+from os import makedirs, path
+from queue import Empty
 import socket
 from struct import pack
+from threading import Thread
+from time import localtime, strftime
+from timeit import timeit
 from yaspin import yaspin
 
-from util.data_looper import DataLooper
+from util.analysis import SessionAnalysis
 from util.data_packet import DataPacket
-from workers.recorder import worker
+from util.delta import ReferenceLap
+from util.export import convert_recording, export_recording
+from util.histogram import LatencyHistogram
+from util.hub import TelemetryHub
+from util.latency import latency_name, LatencyStats, STAGES
+from util.packet_cache import convert_row, PacketCache
+from util.recording import RecordingReader, RecordingWriter
+from util.ring_buffer import PacketRingBuffer
+from util.season import SeasonAnalysis
+from util.track_map import TrackMap
+from util.scheduler import PeriodicScheduler
+from workers.load_generator import sender
+from workers.recorder import stream_worker, worker
 
 @click.group()
 def cli():
@@ -27,7 +45,7 @@ def cli():
 @click.option(
     '--file-path',
     required=True,
-    help='Path to save the data recording at (ex. recording.json.gz - must be of .json.gz extension)'
+    help='Path to save the data recording at (ex. recording.fzr - must be of .fzr or .json.gz extension)'
 )
 @click.option(
     '--host',
@@ -42,45 +60,90 @@ def cli():
 )
 def record(game_version, file_path, host, port):
     '''
-        Easily record Forza Data Packets into compressed JSON files so that they
-        can be reported off of or rebroadcasted at a later date.
+        Easily record Forza Data Packets into compressed binary (.fzr) or JSON
+        files so that they can be reported off of or rebroadcasted at a later date.
     '''
     # Check the file extension provided
+    if file_path.endswith('.fzr'):
+        return record_stream(game_version, file_path, host, port)
     if '.'.join(file_path.split('.')[-2:]) != 'json.gz':
-        raise Exception(f"File name must be prepended with '.json.gz': {file_path}")
-
-    with Manager() as manager:
-        # Create a shared list and a worker process to handle the actual recording
-        packets = manager.list()
-        p = Process(target=worker, args=(packets, game_version, host, port,))
-        p.start()
-
-        # Wait for the worker to start and potentially error out
-        p.join(0.1)
-        if not p.is_alive():
-            print('Error starting worker, most likely a data format issue is occurring.')
-            return
+        raise Exception(f"File name must be appended with '.fzr' or '.json.gz': {file_path}")
 
-        # Wait for the User to stop recording
-        input('Press any key when you are ready to stop recording.')
+    # Create a shared ring buffer and a worker process to receive the packets
+    ring = PacketRingBuffer(create=True)
+    p = Process(target=worker, args=(ring.name, game_version, host, port,))
+    p.start()
 
-        # Terminate the worker process if applicable
-        try:
-            p.terminate()
-        except:
-            pass
+    # Wait for the worker to start and potentially error out
+    p.join(0.1)
+    if not p.is_alive():
+        print('Error starting worker, most likely a data format issue is occurring.')
+        ring.close()
+        ring.unlink()
+        return
 
-        # Ensure some data was recorded
-        if len(packets) == 0:
-            print('No data was recorded, not saving to a file.')
-            return
+    # Collect the raw packet values in the background
+    dp = DataPacket(version=game_version)
+    packets = []
+    stop_event = Event()
+    def collect():
+        while not stop_event.wait(0.01):
+            for packet in ring.read_new():
+                packets.append(dp.decode(packet, recording=True))
+        # Drain the packets published since the last poll
+        for packet in ring.read_new():
+            packets.append(dp.decode(packet, recording=True))
+    collector = Thread(target=collect)
+    collector.start()
+
+    # Wait for the User to stop recording
+    input('Press any key when you are ready to stop recording.')
+
+    # Terminate the worker process if applicable
+    try:
+        p.terminate()
+    except:
+        pass
+    stop_event.set()
+    collector.join()
+    dropped = ring.dropped
+    ring.close()
+    ring.unlink()
+    # Packets are lost if the collector falls a full ring behind the worker
+    if dropped:
+        print(f'{dropped:,} packets were dropped as the ring buffer overran.')
 
-        # Save the packets before closing the Manager (or we lose the values)
-        with gzip.open(file_path, 'wb') as f:
-            f.write(dumps(list(packets)).encode('utf-8'))
+    # Ensure some data was recorded
+    if len(packets) == 0:
+        print('No data was recorded, not saving to a file.')
+        return
+
+    with gzip.open(file_path, 'wb') as f:
+        f.write(dumps(packets).encode('utf-8'))
 
     print('Saved file to:', file_path)
 
+def record_stream(game_version, file_path, host, port):
+    '''Record packets straight to a binary recording file'''
+    stop_event = Event()
+    p = Process(target=stream_worker, args=(file_path, stop_event, game_version, host, port,))
+    p.start()
+
+    # Wait for the worker to start and potentially error out
+    p.join(0.1)
+    if not p.is_alive():
+        print('Error starting worker, most likely a data format issue is occurring.')
+        return
+
+    # Wait for the User to stop recording, then let the worker finish the file
+    input('Press any key when you are ready to stop recording.')
+    stop_event.set()
+    p.join()
+
+    recording = RecordingReader(file_path)
+    print(f'Saved {len(recording):,} packets to:', file_path)
+    recording.close()
+
 @cli.command()
 @click.option(
     '--game-version',
@@ -104,12 +167,23 @@ def record(game_version, file_path, host, port):
     default=1000 / 60,
     help='Rate at which to send packets (in ms) - default: 16.6666 (1000 / 60 - 60hz)'
 )
+@click.option(
+    '--speed',
+    default=1.0,
+    type=click.FloatRange(0.5, 10),
+    help='Playback speed multiplier applied to the rate (0.5 - 10) - default: 1.0'
+)
 @click.option(
     '--input-file',
     required=True,
     help='Sample data use in the rebroadcast'
 )
-def rebroadcast(game_version, host, port, rate, input_file):
+@click.option(
+    '--cache-dir',
+    default=None,
+    help='Directory to cache the prepared packets in for faster startup (ex. .cache)'
+)
+def rebroadcast(game_version, host, port, rate, speed, input_file, cache_dir):
     '''
         Rebroadcast recorded Forza Data Packets to an endpoint at a specified
         rate. Recordings are backwards compatible, however, they are not forward
@@ -121,44 +195,497 @@ def rebroadcast(game_version, host, port, rate, input_file):
     # Create socket
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
-    # Set the format for the game version
-    if game_version == 'sled':
-        data_format = DataPacket._default_format
-    elif game_version == 'dash':
-        data_format = DataPacket._dash_format
-    elif game_version == 'fh4+':
-        data_format = DataPacket._horizon_format
+    # Convert the recording into ready-to-send packets once
+    packets = PacketCache(input_file, game_version, cache_dir)
+    buffer = memoryview(packets.buffer)
+    size = packets.packet_size
+    scheduler = PeriodicScheduler(rate / 1000, speed)
 
     # Loop data until canceled
     packets_sent = 0
     with yaspin(color='green') as spinner:
-        for row in DataLooper(input_file, rate):
-            # Prevent older recordings being used on newer versions
-            if game_version == 'dash':
-                if len(row) == 58:
-                    raise Exception('Data is of "sled" format but game version was set to "dash".')
-            elif game_version == 'fh4+' and len(row) != 89:
-                data_type = 'unknown'
-                if len(row) == 58:
-                    data_type = 'sled'
-                elif len(row) == 85:
-                    data_type = 'dash'
-                raise Exception(f'Data is of type "{data_type}" but game version was set to "fh4+".')
-
-            # Truncate the data as needed for older versions for backwards compatibility
-            if len(row) == 89: # FH4+ field length
-                if game_version == 'sled':
-                    row = row[0:58]
-                elif game_version == 'dash':
-                    row = row[0:58] + row[61:88]
-
-            # Send data packet
-            sock.sendto(pack(data_format, *row), (host, port))
-            packets_sent += 1
-            spinner.text = f'{packets_sent:,} packets sent in total'
+        while True:
+            for offset in range(0, len(buffer), size):
+                # Send data packet
+                scheduler.wait()
+                sock.sendto(buffer[offset:offset + size], (host, port))
+                packets_sent += 1
+
+                # Refresh the status roughly every second at 60hz
+                if packets_sent % 60 == 0:
+                    stats = scheduler.stats
+                    spinner.text = (
+                        f'{packets_sent:,} packets sent in total '
+                        f"(jitter avg {stats['jitter_avg_ms']}ms, max {stats['jitter_max_ms']}ms, {stats['overruns']:,} overruns)"
+                    )
 
     # If the loop exits, close the socket if necessary
     sock.close()
 
+@cli.command()
+@click.option(
+    '--listen',
+    required=True,
+    multiple=True,
+    help='Address, port and game version (or auto to detect each packet) to listen on, can be repeated (ex. 0.0.0.0:5555:fh4+)'
+)
+@click.option(
+    '--record-dir',
+    default=None,
+    help='Directory to save a binary recording for each rig in (ex. recordings)'
+)
+def hub(listen, record_dir):
+    '''
+        Receive Forza Data Packets from many rigs in a single process. Rigs
+        are identified by their address and can optionally be recorded into
+        a binary recording per rig.
+    '''
+    listeners = []
+    for value in listen:
+        host, port, game_version = value.rsplit(':', 2)
+        if game_version != 'auto' and game_version not in DataPacket._packet_lengths:
+            raise Exception(f'Unsupported game version: {game_version}')
+        listeners.append((host, int(port), game_version))
+
+    # Ensure the recording directory exists, recordings are named by session so restarts do not overwrite them
+    if record_dir is not None:
+        makedirs(record_dir, exist_ok=True)
+    session = strftime('%Y%m%d-%H%M%S', localtime())
+
+    async def run_hub(spinner):
+        telemetry_hub = TelemetryHub(listeners)
+        await telemetry_hub.start()
+        recorder = telemetry_hub.subscribe(maxsize=4096, raw=True)
+        writers = {}
+        try:
+            while True:
+                rig, game_version, packet = await recorder.get()
+                # Record each rig into its own file
+                if record_dir is not None:
+                    key = (rig, game_version)
+                    if key not in writers:
+                        file_path = path.join(record_dir, f"{session}-{rig.replace(':', '_')}-{game_version}.fzr")
+                        writers[key] = RecordingWriter(file_path, version=game_version)
+                    writers[key].write(packet)
+
+                rigs = ', '.join(f'{address}: {count:,}' for address, count in telemetry_hub.rigs.items())
+                versions = ', '.join(f'{version}: {count:,}' for version, count in telemetry_hub.versions.items())
+                spinner.text = f'{rigs} [{versions}] ({recorder.dropped:,} dropped, {telemetry_hub.invalid:,} invalid)'
+        finally:
+            telemetry_hub.close()
+            for writer in writers.values():
+                writer.close()
+
+    with yaspin(color='green') as spinner:
+        try:
+            asyncio.run(run_hub(spinner))
+        except KeyboardInterrupt:
+            pass
+
+@cli.command()
+@click.option(
+    '--game-version',
+    required=True,
+    type=click.Choice(['sled', 'dash', 'fh4+'], case_sensitive=False),
+    help='Version of the Telemetry to generate packets for'
+)
+@click.option(
+    '--target',
+    required=True,
+    multiple=True,
+    help='Host and port to send packets to, optionally with its own rate in ms, can be repeated (ex. 127.0.0.1:5555 or 127.0.0.1:5556@8.33)'
+)
+@click.option(
+    '--input-file',
+    required=True,
+    multiple=True,
+    help='Recording to send, can be repeated - targets are assigned recordings in turn'
+)
+@click.option(
+    '--rate',
+    default=1000 / 60,
+    type=float,
+    help='Rate at which to send packets to each target (in ms), 0 to send as fast as possible - default: 16.6666 (60hz)'
+)
+@click.option(
+    '--duration',
+    default=10,
+    type=float,
+    help='Number of seconds to generate load for - default: 10'
+)
+@click.option(
+    '--processes',
+    default=None,
+    type=int,
+    help='Number of sender processes - default: one per target (up to the CPU count)'
+)
+@click.option(
+    '--cache-dir',
+    default=None,
+    help='Directory to cache the prepared packets in for faster startup (ex. .cache)'
+)
+def loadgen(game_version, target, input_file, rate, duration, processes, cache_dir):
+    '''
+        Generate load against one or more receivers by rebroadcasting
+        recordings to many targets from several processes, reporting the
+        achieved packets per second, send latency and drops.
+    '''
+    # Parse targets (host:port[@rate_ms]) and assign each a recording
+    targets = []
+    for i, value in enumerate(target):
+        address, _, target_rate = value.partition('@')
+        host, port = address.rsplit(':', 1)
+        target_rate = float(target_rate) if target_rate else rate
+        if target_rate < 0:
+            raise Exception(f'Rate must be zero or greater: {value}')
+        targets.append((host, int(port), input_file[i % len(input_file)], target_rate))
+
+    # Build each cache once up front so the senders only read it
+    if cache_dir is not None:
+        for file in set(input_file):
+            PacketCache(file, game_version, cache_dir)
+
+    # Spread the targets over the sender processes
+    processes = min(len(targets), processes or cpu_count())
+    results = Queue()
+    senders = []
+    for i in range(processes):
+        args = (targets[i::processes], game_version, duration, cache_dir, results)
+        senders.append(Process(target=sender, args=args))
+    with yaspin(color='green', text=f'Sending to {len(targets)} targets from {processes} processes') as spinner:
+        for p in senders:
+            p.start()
+        reports = []
+        while len(reports) < len(senders):
+            try:
+                reports.append(results.get(timeout=1))
+            except Empty:
+                # A sender which died will never report, so stop the others rather than waiting forever
+                failed = [p for p in senders if p.exitcode not in (None, 0)]
+                if failed:
+                    for p in senders:
+                        p.terminate()
+                    spinner.fail('Failed')
+                    raise Exception(f'{len(failed)} of {len(senders)} sender processes failed (exit code {failed[0].exitcode})')
+        for p in senders:
+            p.join()
+        spinner.ok('Done')
+
+    # Combine the results of every process
+    histogram = LatencyHistogram()
+    total_sent = total_dropped = 0
+    for report in reports:
+        histogram.merge(LatencyHistogram(bytearray(report['histogram'])))
+        for address, sent, dropped, elapsed in report['targets']:
+            print(f'{address:>21}: {sent / elapsed:,.1f} packets/sec ({sent:,} sent, {dropped:,} dropped)')
+            total_sent += sent
+            total_dropped += dropped
+
+    summary = histogram.summary()
+    print(f'{"total":>21}: {total_sent / duration:,.1f} packets/sec ({total_sent:,} sent, {total_dropped:,} dropped)')
+    print(f"Send latency: p50 {summary['p50_ms']}ms, p90 {summary['p90_ms']}ms, p99 {summary['p99_ms']}ms, max {summary['max_ms']}ms")
+
+@cli.command()
+@click.option(
+    '--input-file',
+    default='data/fh5_free_roam.json.gz',
+    help='FH4+ recording used to build sample packets (ex. data/fh5_free_roam.json.gz)'
+)
+@click.option(
+    '--count',
+    default=10000,
+    type=int,
+    help='Number of packets to parse for each game version (ex. 10000)'
+)
+def benchmark(input_file, count):
+    '''
+        Compare the compiled DataPacket decoder against the attribute-based
+        parser for each game version using packets built from a recording.
+    '''
+    with gzip.open(input_file, 'rb') as f:
+        rows = loads(f.read())
+
+    for game_version in ['sled', 'dash', 'fh4+']:
+        dp = DataPacket(version=game_version)
+        packets = [pack(dp._packet_format, *convert_row(row, game_version)) for row in rows]
+        # Cycle through the sample packets until we reach the requested count
+        samples = [packets[i % len(packets)] for i in range(count)]
+
+        parse_secs = timeit(lambda: [dp.parse(packet) for packet in samples], number=1)
+        decode_secs = timeit(lambda: [dp.decode(packet) for packet in samples], number=1)
+        print(
+            f'{game_version:>5}: parse {parse_secs / count * 1e6:.2f}us/packet, '
+            f'decode {decode_secs / count * 1e6:.2f}us/packet '
+            f'({parse_secs / decode_secs:.1f}x faster)'
+        )
+
+@cli.command()
+@click.option(
+    '--input-file',
+    required=True,
+    help='Recording to analyse (ex. session.fzr or recording.json.gz)'
+)
+@click.option(
+    '--game-version',
+    default=None,
+    type=click.Choice(['dash', 'fh4+'], case_sensitive=False),
+    help='Version of the Telemetry in a JSON recording - default: detected from the recording'
+)
+@click.option(
+    '--sectors',
+    default=3,
+    type=click.IntRange(1, 20),
+    help='Number of sectors to split each lap into - default: 3'
+)
+def analyze(input_file, game_version, sectors):
+    '''
+        Break a recorded session down into laps and stints, showing the
+        time, sectors, fuel, tire temperature and wheel slip of each lap.
+    '''
+    analysis = SessionAnalysis.from_file(input_file, game_version, sectors)
+
+    # Per-lap breakdown
+    for lap in analysis.laps:
+        status = '' if lap['complete'] else ' (incomplete)'
+        delta = '' if lap['delta'] is None else f" ({'+' if lap['delta'] > 0 else ''}{lap['delta']}s)"
+        print(f"Lap {lap['lap'] + 1}{status}: {lap['time']}s{delta}, {lap['distance']}m, fuel {round(lap['fuel_used'] * 100, 2)}%")
+        if lap['sectors'] is not None:
+            print(f"  sectors: {' / '.join(f'{value}s' for value in lap['sectors'])}")
+        print(f"  speed: avg {lap['speed_avg']}, max {lap['speed_max']} mph - throttle {lap['throttle_avg']}%, brake {lap['brake_avg']}%")
+        temps = ', '.join(f"{wheel} {round(lap['tire_temp_avg'][wheel])}/{round(lap['tire_temp_max'][wheel])}" for wheel in lap['tire_temp_avg'])
+        print(f'  tire temp (avg/max): {temps}')
+        slip = ', '.join(f"{wheel} {lap['slip_avg'][wheel]}/{lap['slip_max'][wheel]}" for wheel in lap['slip_avg'])
+        print(f'  wheel slip (avg/max): {slip}')
+
+    # Stint and session summaries
+    for i, stint in enumerate(analysis.stints):
+        fuel_per_lap = '-' if stint['fuel_per_lap'] is None else f"{round(stint['fuel_per_lap'] * 100, 2)}%"
+        print(
+            f"Stint {i + 1}: {stint['complete_laps']} laps, best {stint['best_lap'] or '-'}s, "
+            f"average {stint['average_lap_time'] or '-'}s, fuel per lap {fuel_per_lap}"
+        )
+    summary = analysis.summary()
+    if summary['laps'] == 0:
+        print(f"No complete laps found ({summary['packets']:,} packets in race)")
+        return
+    print(f"Best lap: {summary['best_lap']}s (lap {summary['best_lap_num'] + 1}) over {summary['laps']} laps")
+
+@cli.command()
+@click.option(
+    '--input-file',
+    required=True,
+    help='Recording to compare the laps of (ex. session.fzr or recording.json.gz)'
+)
+@click.option(
+    '--cache-dir',
+    default='.cache/tracks',
+    help='Directory to cache track maps in - default: .cache/tracks'
+)
+@click.option(
+    '--sectors',
+    default=3,
+    type=click.IntRange(1, 20),
+    help='Number of sectors to split each lap into - default: 3'
+)
+def corners(input_file, cache_dir, sectors):
+    '''
+        Map the track of a recording (or load the cached map) and compare
+        the sector and corner times of each lap against the best.
+    '''
+    analysis = SessionAnalysis.from_file(input_file, sectors=sectors)
+    track_map = TrackMap.from_analysis(analysis, cache_dir)
+    laps = track_map.compare_laps(analysis)
+    print(f'Track {track_map.track}: {round(track_map.lap_distance)}m, {len(track_map.corners)} corners')
+
+    # Best time of each sector and corner across the laps
+    best_sectors = [min(lap['sectors'][i] for lap in laps) for i in range(sectors)]
+    best_corners = [
+        min((lap['corners'][i]['time'] for lap in laps if lap['corners'][i]['time'] is not None), default=None)
+        for i in range(len(track_map.corners))
+    ]
+    for lap in laps:
+        print(f"Lap {lap['lap'] + 1}: {lap['time']}s")
+        deltas = [f'{value}s (+{round(value - best, 3)})' for value, best in zip(lap['sectors'], best_sectors)]
+        print(f"  sectors: {' / '.join(deltas)}")
+        for i, (corner, timing) in enumerate(zip(track_map.corners, lap['corners'])):
+            if timing['time'] is None:
+                continue
+            print(
+                f"  corner {i + 1} ({corner['direction']}, {round(corner['apex'] * track_map.lap_distance)}m): "
+                f"{timing['time']}s (+{round(timing['time'] - best_corners[i], 3)}), min speed {timing['min_speed']} mph"
+            )
+
+@cli.command()
+@click.option(
+    '--input-file',
+    required=True,
+    help='Recording to take the best lap from (ex. session.fzr or recording.json.gz)'
+)
+@click.option(
+    '--reference-dir',
+    default='references',
+    help='Directory the dashboard loads reference laps from - default: references'
+)
+def reference(input_file, reference_dir):
+    '''
+        Save the best lap of a recording as the reference lap the dashboard
+        shows the time gain against, unless a faster lap is already saved.
+    '''
+    analysis = SessionAnalysis.from_file(input_file)
+    summary = analysis.summary()
+    if summary['laps'] == 0:
+        raise Exception(f'No complete laps found in: {input_file}')
+    lap = ReferenceLap.from_analysis(analysis)
+
+    # Keep the existing reference if it is faster
+    file_path = path.join(reference_dir, f"{summary['car_ordinal_id']}-{summary['track']}.npy")
+    if path.isfile(file_path):
+        existing = ReferenceLap.load(file_path)
+        if existing.lap_time <= lap.lap_time:
+            print(f'Kept the existing {existing.lap_time}s reference lap (best lap of the recording: {lap.lap_time}s)')
+            return
+
+    makedirs(reference_dir, exist_ok=True)
+    lap.save(file_path)
+    print(f'Saved a {lap.lap_time}s reference lap to: {file_path}')
+
+@cli.command()
+@click.option(
+    '--input-dir',
+    required=True,
+    help='Directory of recordings to analyse (ex. recordings)'
+)
+@click.option(
+    '--cache-dir',
+    default='.cache',
+    help='Directory to cache the session summaries in - default: .cache'
+)
+@click.option(
+    '--processes',
+    default=None,
+    type=int,
+    help='Number of processes to analyse recordings with - default: the CPU count'
+)
+def season(input_dir, cache_dir, processes):
+    '''
+        Summarise every recording in a directory using all cores, showing
+        the best lap, average lap time and fuel usage of each car per track.
+        Only new or changed recordings are analysed on later runs.
+    '''
+    analysis = SeasonAnalysis(input_dir, cache_dir, processes)
+    with yaspin(color='green', text=f'Analysing {len(analysis.recordings)} recordings') as spinner:
+        summaries = analysis.summaries()
+        spinner.ok(f'Done ({analysis.analysed} analysed, {analysis.cached} cached)')
+
+    # Report any recordings which could not be analysed
+    for file, summary in summaries.items():
+        if 'error' in summary:
+            print(f"Skipped {file}: {summary['error']}")
+
+    aggregates = analysis.aggregate(summaries)
+    if not aggregates:
+        print('No complete laps found.')
+        return
+    for (track, car), aggregate in sorted(aggregates.items(), key=lambda item: (item[0][0], item[1]['best_lap'])):
+        fuel_per_lap = '-' if aggregate['fuel_per_lap'] is None else f"{round(aggregate['fuel_per_lap'] * 100, 2)}%"
+        print(
+            f"Track {track}, car {car} (PI {aggregate['car_performance_index']}): "
+            f"best {aggregate['best_lap']}s, average {aggregate['average_lap_time']}s, fuel per lap {fuel_per_lap} "
+            f"- {aggregate['laps']} laps over {aggregate['sessions']} sessions (best: {aggregate['best_lap_file']})"
+        )
+
+@cli.command()
+@click.option(
+    '--input-file',
+    required=True,
+    help='Recording to convert (ex. recording.json.gz)'
+)
+@click.option(
+    '--output-file',
+    required=True,
+    help='Binary recording to write (ex. session.fzr)'
+)
+@click.option(
+    '--game-version',
+    default=None,
+    type=click.Choice(['sled', 'dash', 'fh4+'], case_sensitive=False),
+    help='Version of the Telemetry in a JSON recording - default: detected from the recording'
+)
+@click.option(
+    '--codec',
+    default='channel',
+    type=click.Choice(['channel', 'zlib'], case_sensitive=False),
+    help='Block codec, channel (per-channel delta/XOR) or zlib - default: channel'
+)
+def convert(input_file, output_file, game_version, codec):
+    '''
+        Convert a recording into a compact binary recording, ex. to
+        archive JSON recordings.
+    '''
+    with yaspin(color='green', text=f'Converting {input_file}') as spinner:
+        packets = convert_recording(input_file, output_file, game_version, codec)
+        spinner.ok('Done')
+    print(f'Converted {packets:,} packets ({path.getsize(input_file):,} to {path.getsize(output_file):,} bytes)')
+
+@cli.command()
+@click.option(
+    '--input-file',
+    required=True,
+    help='Recording to export (ex. session.fzr or recording.json.gz)'
+)
+@click.option(
+    '--output-file',
+    required=True,
+    help='File to export to, .parquet for Parquet or .arrow / .feather for Arrow IPC'
+)
+@click.option(
+    '--game-version',
+    default=None,
+    type=click.Choice(['sled', 'dash', 'fh4+'], case_sensitive=False),
+    help='Version of the Telemetry in a JSON recording - default: detected from the recording'
+)
+@click.option(
+    '--chunk-size',
+    default=65536,
+    type=click.IntRange(1),
+    help='Number of packets per row group (held in memory at once) - default: 65536'
+)
+def export(input_file, output_file, game_version, chunk_size):
+    '''
+        Export a recording to Parquet or Arrow IPC with a typed column per
+        attribute, for use with pandas, Polars, DuckDB etc.
+    '''
+    with yaspin(color='green', text=f'Exporting {input_file}') as spinner:
+        rows = export_recording(input_file, output_file, game_version, chunk_size)
+        spinner.ok('Done')
+    print(f'Exported {rows:,} packets to {output_file}')
+
+@cli.command()
+@click.option(
+    '--port',
+    default=5555,
+    type=int,
+    help='Port the dashboard is listening on - default: 5555'
+)
+def latency(port):
+    '''
+        Print the latency percentiles of a running dashboard, from the
+        packet being received until it is painted on screen.
+    '''
+    try:
+        stats = LatencyStats(latency_name(port), track=False)
+    except FileNotFoundError:
+        raise Exception(f'No latency statistics found for port {port} - is the dashboard running?')
+
+    summary = stats.summary()
+    stats.close()
+    for stage in STAGES:
+        values = summary[stage]
+        print(
+            f"{stage:>8}: p50 {values['p50_ms']}ms, p90 {values['p90_ms']}ms, "
+            f"p99 {values['p99_ms']}ms, max {values['max_ms']}ms ({values['count']:,} packets)"
+        )
+    print(f"  frames: {summary['frames']:,} painted, {summary['dropped_frames']:,} dropped")
+
 if __name__ == '__main__':
     cli()
\ No newline at end of file
@@ -1,8 +1,17 @@
 class I2CDeviceMock():
-    '''Mock I2CDevice class with no functions simulated'''
+    '''Mock I2CDevice class with register writes logged'''
     def __init__(self, _, address):
         self.device_address = address
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+    def write(self, buffer):
+        print(f'[I2CDevice-Mock-{self.device_address}] Write register', hex(buffer[0]), 'values', list(buffer[1:]))
+
 class AW9523():
     '''Mock AW9523 class with the basic LED functions simulated/logged'''
     _LED_MODES = None
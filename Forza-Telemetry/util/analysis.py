@@ -0,0 +1,307 @@
+import numpy as np
+
+from util.batch_decoder import BatchDecoder
+from util.data_looper import DataLooper
+from util.packet_cache import PacketCache
+from util.recording import RecordingReader
+
+# Game version of a recorded row by its number of fields
+_row_versions = {58: 'sled', 85: 'dash', 89: 'fh4+'}
+
+_wheels = ['FL', 'FR', 'RL', 'RR']
+
+def load_recording(file, game_version = None):
+    '''
+        Load every packet of a recording (.fzr, .json or .json.gz) into a
+        NumPy structured array of converted values, returning the game
+        version and the array. JSON recordings are assumed to be of the
+        version matching their row length unless one is given
+    '''
+    if file.endswith('.fzr'):
+        reader = RecordingReader(file)
+        try:
+            version = reader.packet_version
+            buffer = b''.join(reader.read_block(block) for block in range(len(reader.blocks)))
+        finally:
+            reader.close()
+        if game_version is not None and game_version != version:
+            raise ValueError(f'Recording is of type "{version}" but game version was set to "{game_version}".')
+    else:
+        version = game_version or detect_version(file)
+        buffer = PacketCache(file, version).buffer
+
+    return version, BatchDecoder(version).decode(buffer)
+
+def detect_version(file):
+    '''Detect the game version of a JSON recording from its first row'''
+    row = next(DataLooper(file).rows(), None)
+    if row is None:
+        raise ValueError(f'No data found in file: {file}')
+    if len(row) not in _row_versions:
+        raise ValueError(f'Unknown recording row length {len(row)}: {file}')
+    return _row_versions[len(row)]
+
+def track_key(x, z, distance = None):
+    '''
+        Fingerprint a track from the start/finish line position (on a 50m
+        grid) and the lap distance (to the nearest 100m). Without a
+        distance only the start/finish line part is returned
+    '''
+    key = f'{round(float(x) / 50) * 50}_{round(float(z) / 50) * 50}'
+    if distance is None:
+        return key
+    return f'{key}_{round(float(distance) / 100) * 100}'
+
+class SessionAnalysis():
+    '''
+        SessionAnalysis - segment a recorded session into laps and stints
+        and compute per-lap statistics (time, fuel, distance, tire
+        temperature, wheel slip and sector times) a column at a time
+    '''
+    def __init__(self, data, sectors = 3):
+        '''
+            Session Analysis
+            (data = structured array from load_recording, sectors = number of sectors per lap)
+        '''
+        if 'lap_num' not in data.dtype.names:
+            raise ValueError('Lap analysis requires dash or fh4+ recordings')
+        if sectors < 1:
+            raise ValueError('Sectors must be one or greater')
+
+        # Only packets from an active race are analysed, without the packets undone by rewinds
+        self.data = self._trim_rewinds(data[(data['active'] == 1) & (data['race_position'] > 0)])
+        self.sectors = sectors
+
+        self.laps = self._segment_laps()
+        self._split_sectors()
+        self.stints = self._segment_stints()
+
+    @classmethod
+    def from_file(cls, file, game_version = None, sectors = 3):
+        '''Load and analyse a recording'''
+        _, data = load_recording(file, game_version)
+        return cls(data, sectors)
+
+    @property
+    def complete_laps(self):
+        '''Laps which were driven from start to finish'''
+        return [lap for lap in self.laps if lap['complete']]
+
+    @property
+    def best_lap(self):
+        '''The fastest complete lap (or None)'''
+        return min(self.complete_laps, key=lambda lap: lap['time'], default=None)
+
+    @property
+    def track(self):
+        '''
+            Identify the track from where laps start and the lap distance
+            (see track_key) as the packets do not include a track id. None
+            if no lap was completed
+        '''
+        laps = self.complete_laps
+        if not laps:
+            return None
+        start = laps[0]['start']
+        distance = float(np.median([lap['distance'] for lap in laps]))
+        return track_key(self.data['position_x'][start], self.data['position_z'][start], distance)
+
+    def summary(self):
+        '''Return the headline values of the session'''
+        laps = self.complete_laps
+        best_lap = self.best_lap
+        fuel_laps = [lap['fuel_used'] for lap in laps if lap['fuel_used'] > 0]
+        summary = {
+            'packets': len(self.data),
+            'laps': len(laps),
+            'best_lap': None if best_lap is None else best_lap['time'],
+            'best_lap_num': None if best_lap is None else best_lap['lap'],
+            'average_lap_time': float(np.mean([lap['time'] for lap in laps])) if laps else None,
+            'fuel_per_lap': float(np.mean(fuel_laps)) if fuel_laps else None,
+            'distance': float(sum(lap['distance'] for lap in self.laps)),
+            'stints': len(self.stints),
+            'track': self.track,
+        }
+        # Identify the car used for the session
+        for key in ['car_ordinal_id', 'car_class_id', 'car_performance_index']:
+            summary[key] = int(self.data[key][0]) if len(self.data) else None
+        return summary
+
+    @staticmethod
+    def _trim_rewinds(data):
+        '''
+            Remove the packets undone by rewinds. Within a lap the lap time
+            only goes backwards when the car is rewound (or the lap timer
+            starts, ex. a rolling start), so any packet followed by an
+            earlier lap time in the same lap is dropped (Private)
+        '''
+        if len(data) == 0:
+            return data
+        lap_time = data['lap_time_current'].astype(np.float64)
+        # Ignore pauses (a lap time of 0)
+        lap_time[lap_time == 0] = np.inf
+        starts = np.flatnonzero(data['lap_num'][1:] != data['lap_num'][:-1]) + 1
+        keep = np.ones(len(data), dtype=bool)
+        for start, end in zip(np.concatenate(([0], starts)), np.concatenate((starts, [len(data)]))):
+            times = lap_time[start:end]
+            # Earliest lap time of the packets following each packet
+            following = np.append(np.minimum.accumulate(times[::-1])[::-1][1:], np.inf)
+            # Pauses take the lap time after them, so those before the timer started are dropped too
+            timed = np.flatnonzero(~np.isinf(times))
+            after = np.searchsorted(timed, np.arange(len(times)))
+            times = np.where(after < len(timed), times[timed[np.minimum(after, len(timed) - 1)]], np.inf) if len(timed) else times
+            keep[start:end] = times <= following
+        return data[keep]
+
+    def _segment_laps(self):
+        '''
+            Split the session into laps, a new lap starts whenever the lap
+            number changes (Private)
+        '''
+        data = self.data
+        if len(data) == 0:
+            return []
+        lap_time = data['lap_time_current']
+        starts = np.flatnonzero(data['lap_num'][1:] != data['lap_num'][:-1]) + 1
+        bounds = np.concatenate(([0], starts))
+        ends = np.concatenate((starts, [len(data)]))
+        counts = ends - bounds
+
+        # The first packet of the next lap holds the finished lap's values
+        finish = np.minimum(ends, len(data) - 1)
+        lap_num = data['lap_num'][bounds].astype(np.int64)
+        # Laps are complete if seen from the start (the line or the grid) and followed
+        # by the next lap, otherwise they were abandoned (ex. restarts) or joined part way
+        complete = np.zeros(len(bounds), dtype=bool)
+        complete[:-1] = (lap_num[1:] == lap_num[:-1] + 1) & (lap_time[bounds[:-1]] < 1)
+        times = np.where(complete, data['lap_time_last'][finish], lap_time[ends - 1])
+
+        distance = data['dist_traveled'][finish] - data['dist_traveled'][bounds]
+        fuel_used = data['fuel'][bounds] - data['fuel'][finish]
+        speed = data['speed'].astype(np.float64)
+        speed_avg = np.add.reduceat(speed, bounds) / counts
+        speed_max = np.maximum.reduceat(speed, bounds)
+        throttle_avg = np.add.reduceat(data['throttle'].astype(np.float64), bounds) / counts
+        brake_avg = np.add.reduceat(data['brake'].astype(np.float64), bounds) / counts
+
+        # Per-wheel tire temperature and slip statistics
+        wheel_stats = {}
+        for key, column in [('tire_temp', 'tire_temp'), ('slip', 'wheel_combined_slip')]:
+            for wheel in _wheels:
+                values = data[f'{column}_{wheel}'].astype(np.float64)
+                wheel_stats[(key, 'avg', wheel)] = np.add.reduceat(values, bounds) / counts
+                wheel_stats[(key, 'max', wheel)] = np.maximum.reduceat(values, bounds)
+
+        laps = []
+        previous_time = None
+        for i in range(len(bounds)):
+            lap = {
+                'lap': int(lap_num[i]),
+                'complete': bool(complete[i]),
+                'start': int(bounds[i]),
+                'end': int(ends[i]),
+                'time': round(float(times[i]), 3),
+                'distance': round(float(distance[i]), 1),
+                'fuel_used': round(float(fuel_used[i]), 4),
+                'speed_avg': round(float(speed_avg[i]), 1),
+                'speed_max': round(float(speed_max[i]), 1),
+                'throttle_avg': round(float(throttle_avg[i]), 1),
+                'brake_avg': round(float(brake_avg[i]), 1),
+                'sectors': None,
+                'delta': None,
+            }
+            for (key, stat, wheel), values in wheel_stats.items():
+                lap.setdefault(f'{key}_{stat}', {})[wheel] = round(float(values[i]), 4)
+
+            # Time gained or lost against the previous complete lap (as in Telemetry.time_gain)
+            if lap['complete']:
+                if previous_time is not None:
+                    lap['delta'] = round(lap['time'] - previous_time, 3)
+                previous_time = lap['time']
+            laps.append(lap)
+        return laps
+
+    def _split_sectors(self):
+        '''
+            Split each complete lap into sectors. The sector boundaries are
+            the positions (position_x/z) at equal distances around the best
+            lap, each lap is timed (interpolated between packets) where it
+            passes each boundary within the same part of the lap (Private)
+        '''
+        best_lap = self.best_lap
+        if best_lap is None or best_lap['distance'] <= 0:
+            return
+        data = self.data
+        x = data['position_x'].astype(np.float64)
+        z = data['position_z'].astype(np.float64)
+        dist = data['dist_traveled'].astype(np.float64)
+        lap_time = data['lap_time_current'].astype(np.float64)
+
+        # Find the boundary positions on the best lap
+        start, end = best_lap['start'], best_lap['end']
+        lap_dist = dist[start:end] - dist[start]
+        targets = best_lap['distance'] * np.arange(1, self.sectors) / self.sectors
+        covered = np.maximum.accumulate(lap_dist)
+        boundaries = np.column_stack((np.interp(targets, covered, x[start:end]), np.interp(targets, covered, z[start:end])))
+
+        # Only match boundaries within a quarter lap of the expected distance
+        window = best_lap['distance'] / 4
+        for lap in self.complete_laps:
+            start, end = lap['start'], lap['end']
+            lap_dist = dist[start:end] - dist[start]
+            splits = []
+            for (bx, bz), target in zip(boundaries, targets):
+                squared = (x[start:end] - bx) ** 2 + (z[start:end] - bz) ** 2
+                squared[np.abs(lap_dist - target) > window] = np.inf
+                splits.append(self._crossing_time(start + int(np.argmin(squared)), bx, bz, start, end))
+            splits.append(lap['time'])
+            lap['sectors'] = [round(float(value), 3) for value in np.diff(splits, prepend=0)]
+
+    def _crossing_time(self, index, bx, bz, start, end):
+        '''
+            Interpolate the lap time at which a boundary position was passed,
+            projecting it onto the path between the nearest packet and the
+            packet before or after it (Private)
+        '''
+        data = self.data
+        lap_time = data['lap_time_current']
+        for first, second in [(index, index + 1), (index - 1, index)]:
+            if first < start or second >= end:
+                continue
+            x0, z0 = float(data['position_x'][first]), float(data['position_z'][first])
+            vx, vz = float(data['position_x'][second]) - x0, float(data['position_z'][second]) - z0
+            length = vx * vx + vz * vz
+            if length == 0:
+                continue
+            progress = ((bx - x0) * vx + (bz - z0) * vz) / length
+            if 0 <= progress <= 1:
+                return float(lap_time[first]) + progress * (float(lap_time[second]) - float(lap_time[first]))
+        return float(lap_time[index])
+
+    def _segment_stints(self):
+        '''
+            Group the laps into stints, a new stint starts when the car is
+            refueled or a new race begins (the lap number goes back) (Private)
+        '''
+        data = self.data
+        stints = []
+        for lap in self.laps:
+            new_stint = not stints
+            if stints:
+                previous = stints[-1]['laps'][-1]
+                new_stint = lap['lap'] < previous['lap'] or \
+                    data['fuel'][lap['start']] > data['fuel'][previous['end'] - 1] + 0.001
+            if new_stint:
+                stints.append({'laps': []})
+            stints[-1]['laps'].append(lap)
+
+        # Summarise each stint as LapStints would
+        for stint in stints:
+            laps = [lap for lap in stint['laps'] if lap['complete']]
+            fuel_laps = [lap['fuel_used'] for lap in laps if lap['fuel_used'] > 0]
+            stint['laps'] = [lap['lap'] for lap in stint['laps']]
+            stint['complete_laps'] = len(laps)
+            stint['best_lap'] = min((lap['time'] for lap in laps), default=None)
+            stint['average_lap_time'] = round(float(np.mean([lap['time'] for lap in laps])), 3) if laps else None
+            stint['fuel_per_lap'] = round(float(np.mean(fuel_laps)), 4) if fuel_laps else None
+        return stints
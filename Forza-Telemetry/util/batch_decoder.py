@@ -0,0 +1,88 @@
+import numpy as np
+
+from util.data_packet import DataPacket
+
+# Little-endian NumPy equivalents of the struct format characters
+_numpy_types = {
+    'i': '<i4', 'I': '<u4', 'f': '<f4',
+    'H': '<u2', 'B': 'u1', 'b': 'i1',
+}
+
+class BatchDecoder():
+    '''
+        BatchDecoder - decode a contiguous buffer of fixed-size Forza Data
+        Packets into a NumPy structured array in a single call.
+    '''
+    def __init__(self, version = 'sled'):
+        '''
+            Forza Data Packet Batch Decoder
+            (version = sled, dash, fh4+)
+        '''
+        self.packet = DataPacket(version=version)
+        self.packet_version = version
+        self.attributes = self.packet.attributes
+        field_types = self.packet._get_field_types()
+
+        # Raw layout of a packet (packed, no alignment padding)
+        self.raw_dtype = np.dtype([
+            (name, _numpy_types[field_type])
+            for name, field_type in zip(self.attributes, field_types)
+        ])
+        if self.raw_dtype.itemsize != DataPacket._packet_lengths[version]:
+            raise ValueError(f'Invalid dtype size {self.raw_dtype.itemsize} for {version}')
+
+        # Converted values are stored as floats as they are scaled
+        formats = [
+            '<f4' if name in DataPacket._conversions else _numpy_types[field_type]
+            for name, field_type in zip(self.attributes, field_types)
+        ]
+        self._float_fields = [
+            name for name, field_type in zip(self.attributes, field_types)
+            if field_type == 'f' and name not in DataPacket._conversions
+        ]
+
+        # Place the plain float fields first so they can be rounded as one block
+        offsets = {}
+        offset = 0
+        for name in self._float_fields + [name for name in self.attributes if name not in self._float_fields]:
+            offsets[name] = offset
+            offset += np.dtype(formats[self.attributes.index(name)]).itemsize
+        self.dtype = np.dtype({
+            'names': self.attributes,
+            'formats': formats,
+            'offsets': [offsets[name] for name in self.attributes],
+            'itemsize': offset,
+        })
+
+    def decode(self, buffer, recording = False):
+        '''
+            Decode a buffer of N packets into a structured array of N rows.
+            Recordings return a read-only view of the raw (unconverted) values
+        '''
+        size = memoryview(buffer).nbytes
+        if size % self.raw_dtype.itemsize != 0:
+            raise ValueError(f'Invalid buffer length {size}, expected a multiple of {self.raw_dtype.itemsize}')
+
+        raw = np.frombuffer(buffer, dtype=self.raw_dtype)
+        if recording:
+            return raw
+
+        # Apply the unit conversions column by column
+        data = raw.astype(self.dtype)
+        for name, (scale, minimum, ndigits) in DataPacket._conversions.items():
+            if name not in self.dtype.names:
+                continue
+            column = data[name]
+            column *= scale
+            if minimum is not None:
+                np.maximum(column, minimum, out=column)
+            np.round(column, ndigits or 0, out=column)
+
+        # Round any other floats to at most 4 decimal places
+        floats = np.ndarray(
+            shape=(len(data), len(self._float_fields)), dtype='<f4', buffer=data,
+            strides=(self.dtype.itemsize, 4)
+        )
+        np.round(floats, 4, out=floats)
+
+        return data
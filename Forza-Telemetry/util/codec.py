@@ -0,0 +1,107 @@
+import re
+import zlib
+
+import numpy as np
+
+# Unsigned types used to view each field's bits, by field width
+_unsigned_types = {4: '<u4', 2: '<u2', 1: 'u1'}
+_signed_types = {4: '<i4', 2: '<i2', 1: 'i1'}
+
+# Width and kind of each struct format character
+_field_types = {
+    'i': (4, 'int'), 'I': (4, 'int'), 'f': (4, 'float'),
+    'H': (2, 'int'), 'B': (1, 'int'), 'b': (1, 'int'),
+}
+
+class ChannelCodec():
+    '''
+        ChannelCodec - compress blocks of fixed-size packets a channel
+        (field) at a time. Consecutive packets are highly correlated, so
+        integer channels are stored as the (zigzag encoded) difference to
+        the previous packet and float channels as the XOR of their bits
+        with the previous packet (as in Facebook's Gorilla), leaving mostly
+        zero bytes. The bytes are then grouped by significance so the zero
+        runs are contiguous and compressed with zlib.
+    '''
+    def __init__(self, packet_format, compression = 6):
+        '''
+            Channel Codec
+            (packet_format = struct format of a single packet, compression = zlib level)
+        '''
+        self.compression = compression
+        field_types = ''.join(
+            char * int(count or 1)
+            for count, char in re.findall(r'(\d*)([a-zA-Z])', packet_format)
+        )
+        unknown = set(field_types) - set(_field_types)
+        if unknown:
+            raise ValueError(f"Unsupported packet format characters: {', '.join(sorted(unknown))}")
+
+        # Raw layout of a packet with each field viewed as an unsigned integer
+        self.dtype = np.dtype([
+            (f'f{index}', _unsigned_types[_field_types[char][0]])
+            for index, char in enumerate(field_types)
+        ])
+        self.packet_size = self.dtype.itemsize
+
+        # Channels are encoded in groups of the same width, widest first
+        self._groups = []
+        for width in sorted(_unsigned_types, reverse=True):
+            names = [f'f{index}' for index, char in enumerate(field_types) if _field_types[char][0] == width]
+            if not names:
+                continue
+            floats = np.array([_field_types[field_types[int(name[1:])]][1] == 'float' for name in names])
+            self._groups.append((width, names, floats))
+
+    def encode(self, buffer):
+        '''Compress a buffer of N packets'''
+        packets = np.frombuffer(buffer, dtype=self.dtype)
+        planes = []
+        for width, names, floats in self._groups:
+            # One row per channel so each channel is contiguous
+            channels = np.empty((len(names), len(packets)), dtype=_unsigned_types[width])
+            for row, name in enumerate(names):
+                channels[row] = packets[name]
+
+            encoded = channels.copy()
+            if len(packets) > 1:
+                previous, current = channels[:, :-1], channels[:, 1:]
+                # XOR the float bits with the previous value
+                encoded[floats, 1:] = current[floats] ^ previous[floats]
+                # Difference the integers (wrapping) then zigzag encode so small negatives stay small
+                delta = (current[~floats] - previous[~floats]).view(_signed_types[width])
+                bits = width * 8
+                encoded[~floats, 1:] = ((delta << 1) ^ (delta >> (bits - 1))).view(_unsigned_types[width])
+
+            # Group the bytes by significance (all low bytes, ..., all high bytes)
+            planes.append(np.ascontiguousarray(encoded.view('u1').reshape(len(names), len(packets), width).transpose(2, 0, 1)))
+
+        return zlib.compress(b''.join(plane.tobytes() for plane in planes), self.compression)
+
+    def decode(self, data, count):
+        '''Decompress the buffer of count packets returned by encode'''
+        raw = np.frombuffer(zlib.decompress(data), dtype='u1')
+        packets = np.empty(count, dtype=self.dtype)
+        offset = 0
+        for width, names, floats in self._groups:
+            size = len(names) * count * width
+            if offset + size > len(raw):
+                raise ValueError(f'Invalid block length {len(raw)} for {count} packets')
+            planes = raw[offset:offset + size].reshape(width, len(names), count)
+            offset += size
+            encoded = np.ascontiguousarray(planes.transpose(1, 2, 0)).view(_unsigned_types[width]).reshape(len(names), count)
+
+            channels = encoded
+            if count > 1:
+                channels = encoded.copy()
+                # Undo the XOR by accumulating it along each channel
+                channels[floats] = np.bitwise_xor.accumulate(encoded[floats], axis=1)
+                # Undo the zigzag encoding, then sum the differences (wrapping)
+                zigzag = encoded[~floats, 1:]
+                delta = (zigzag >> 1) ^ (0 - (zigzag & 1)).astype(_unsigned_types[width])
+                integers = np.concatenate((encoded[~floats, :1], delta), axis=1)
+                channels[~floats] = np.cumsum(integers, axis=1, dtype=_unsigned_types[width])
+
+            for row, name in enumerate(names):
+                packets[name] = channels[row]
+        return packets.tobytes()
@@ -1,17 +1,24 @@
-from datetime import datetime as datetime
 import gzip
-from json import load
+from json import loads
 from mimetypes import MimeTypes
 from os import path
 
+from util.recording import RecordingReader
+from util.scheduler import PeriodicScheduler
+
 class DataLooper():
     '''
         DataLooper - a class designed to infinitely loop a sample set of
-        data. Supports JSON or GZip'd JSON files
+        data. Supports JSON, GZip'd JSON or binary (.fzr) recordings, which
+        are streamed rather than loaded into memory
     '''
-    def __init__(self, file = 'sample-file.json.gz', data_rate_ms = 250):
+    # Number of characters read from JSON recordings at a time
+    _read_ahead = 64 * 1024
+
+    def __init__(self, file = 'sample-file.json.gz', data_rate_ms = 250, rate_multiplier = 1.0):
         self.file = file
         self.data_rate = data_rate_ms
+        self.rate_multiplier = rate_multiplier
         file_mime = MimeTypes().guess_type(self.file)
 
         # Ensure the file passed is valid
@@ -21,6 +28,15 @@ class DataLooper():
         # Ensure a valid time delta is passed
         if self.data_rate <= 0:
             raise ValueError('Data rate must be greater than zero')
+        if self.rate_multiplier <= 0:
+            raise ValueError('Rate multiplier must be greater than zero')
+        self.scheduler = PeriodicScheduler(self.data_rate / 1000, self.rate_multiplier)
+
+        # Binary recordings are memory-mapped and read block by block
+        if self.file.endswith('.fzr'):
+            self._reader = RecordingReader(self.file)
+            self._rows = self._binary_rows
+            return
 
         # Ensure the file is json
         if file_mime[0] != 'application/json':
@@ -28,44 +44,58 @@ class DataLooper():
 
         # If the file has a secondary file extension, ensure it is gzip
         if file_mime[1] == 'gzip':
-            # Drop the last extension (ex. test.json.gz -> test.json)
-            uncompressed = '.'.join(file.split('.')[:-1])
-            # Check if the file has not been decompressed yet
-            if not path.isfile(uncompressed):
-                self._decompress_data(uncompressed)
-            self.file = uncompressed
+            self._open = lambda: gzip.open(self.file, 'rt')
         # Otherwise, if it has one that is not gzip, fail
         elif file_mime[1] != None:
             raise Exception(f'Unsupported file type (must be gz/gzip): {file_mime[1]}')
-
-        # Load and parse the data from the file
-        self._load_data_from_file()
+        else:
+            self._open = lambda: open(self.file, 'r')
+        self._rows = self._json_rows
 
     def __iter__(self):
         '''Convert the class into an infinite iterable'''
-        index = 0
-        last = datetime.now()
+        self.scheduler.reset()
         # Loop infinitely through the rows
         while True:
-            delta = datetime.now() - last
-            # If we are at or past our requested rate, return a value
-            if delta.total_seconds() * 1000 >= self.data_rate:
-                yield self.data[index]
-                # Set the index for the next iteration
-                if index + 1 == self._data_length:
-                    index = 0
-                else:
-                    index += 1
-                last = datetime.now()
+            rows = 0
+            for row in self._rows():
+                # Wait until the next row is due
+                self.scheduler.wait()
+                yield row
+                rows += 1
+            # Ensure we do not spin forever on an empty recording
+            if rows == 0:
+                raise ValueError(f'No data found in file: {self.file}')
+
+    def rows(self):
+        '''Iterate a single pass of the recording's rows without pacing'''
+        return self._rows()
+
+    def _binary_rows(self):
+        '''Iterate the rows of a binary recording (Private)'''
+        return iter(self._reader)
 
-    def _load_data_from_file(self):
-        '''Load the requested file and parse the JSON'''
-        with open(self.file, 'r') as f:
-            self.data = load(f)
-        self._data_length = len(self.data)
+    def _json_rows(self):
+        '''
+            Lazily iterate the rows of a JSON recording, reading a small
+            chunk at a time. Rows are flat lists of numbers so each one
+            ends at the first closing bracket after it starts (Private)
+        '''
+        with self._open() as f:
+            # Skip past the opening bracket of the outer list
+            buffer = f.read(self._read_ahead).lstrip()[1:]
+            while True:
+                index = 0
+                while True:
+                    start = buffer.find('[', index)
+                    end = buffer.find(']', start)
+                    if start == -1 or end == -1:
+                        break
+                    yield loads(buffer[start:end + 1])
+                    index = end + 1
 
-    def _decompress_data(self, target):
-        '''Gunzip an archive into the uncompressed format'''
-        with gzip.open(self.file, 'rb') as compressed:
-            with open(target, 'wb') as f:
-                f.write(compressed.read())
+                # Keep any partial row and read the next chunk
+                chunk = f.read(self._read_ahead)
+                if not chunk:
+                    break
+                buffer = buffer[index:] + chunk
@@ -1,4 +1,6 @@
-from struct import unpack
+from collections import namedtuple
+import re
+from struct import calcsize, Struct, unpack
 
 class DataPacket():
     '''
@@ -21,10 +23,29 @@ class DataPacket():
         'fh4+': 324,
     }
 
-    def __init__(self, version = 'sled'):
+    # Packet version for each packet length (to detect the version of a packet)
+    _packet_versions = {length: version for version, length in _packet_lengths.items()}
+
+    # Unit conversions applied to parsed values as (scale, minimum, ndigits)
+    _conversions = {
+        'speed': (2.237, None, None), # m/s to mph
+        'power': (1 / 746, 0, 4), # Watt to hp
+        'torque': (1 / 1.356, 0, 4), # Newton meter to ft lbs
+        'throttle': (100 / 255, None, None), # Convert to percentage
+        'brake': (100 / 255, None, None),
+        'clutch': (100 / 255, None, None),
+        'handbrake': (100 / 255, None, None),
+        'suspension_travel': (39.37, None, 4), # Convert meter to inches
+    }
+
+    # Compiled decoders shared between instances (keyed by version and fields)
+    _compiled = {}
+
+    def __init__(self, version = 'sled', fields = None):
         '''
             Forza Data Packet Parser
             (version = sled, dash, fh4+)
+            (fields = optional list of the only fields to decode)
         '''
         # Setup packet format and attributes
         self.packet_version = version
@@ -40,6 +61,20 @@ class DataPacket():
         # Assign attributes based on the packet version
         self.attributes = self.get_attributes()
 
+        # Only decode the requested fields (in packet order) if given
+        self.fields = None
+        if fields is not None:
+            unknown = [name for name in fields if name not in self.attributes]
+            if unknown:
+                raise ValueError(f"Unknown {self.packet_version} fields: {', '.join(unknown)}")
+            self.fields = tuple(name for name in self.attributes if name in fields)
+
+        # Build (or re-use) the compiled decoder for this version and projection
+        key = (self.packet_version, self.fields)
+        if key not in self._compiled:
+            self._compiled[key] = self._compile() if self.fields is None else self._compile_projection()
+        self._struct, self._record, self._raw_record, self._scales, self._ndigits = self._compiled[key]
+
     def __str__(self):
         '''Handle string representation of the class'''
         # Build a list of each attribute in string format
@@ -48,17 +83,7 @@ class DataPacket():
 
     def parse(self, packet, recording = False):
         '''Parse an incoming data packet'''
-        size = len(packet)
-        expected_size = self._packet_lengths[self.packet_version]
-        # Ensure packet is the correct size
-        if expected_size != size:
-            # Attempt to find a match for this packet size
-            try:
-                match = next(filter(lambda x: x[1] == size, self._packet_lengths.items()))
-                extra = f'- this looks like a {match[0]} data packet.'
-            except:
-                extra = ''
-            raise ValueError(f'Invalid {self.packet_version} packet length {size}, expected {expected_size} {extra}')
+        self._validate(packet)
 
         # Setup each value as an attribute on the class
         for name, value in zip(self.attributes, unpack(self._packet_format, packet)):
@@ -67,6 +92,31 @@ class DataPacket():
             value = value if recording else self._convert(name, value)
             setattr(self, name, value)
 
+    def decode(self, packet, recording = False):
+        '''
+            Decode an incoming data packet in a single pass using the
+            compiled decoder, returning a read-only record. With a field
+            projection only those fields are unpacked and converted
+        '''
+        self._validate(packet)
+        values = self._struct.unpack_from(packet)
+
+        # Raw values are returned as-is for recordings
+        if recording:
+            return self._raw_record._make(values)
+
+        values = list(values)
+        for index, scale, minimum in self._scales:
+            value = values[index] * scale
+            values[index] = value if minimum is None else max(minimum, value)
+        # Round every value at once (ints are returned unchanged)
+        return self._record._make(map(round, values, self._ndigits))
+
+    @classmethod
+    def detect_version(cls, packet):
+        '''Return the packet version matching the length of a packet (or None)'''
+        return cls._packet_versions.get(len(packet))
+
     def get_attributes(self):
         '''
             Return the list of attributes applicable
@@ -89,21 +139,84 @@ class DataPacket():
 
     def _convert(self, key, value):
         '''Convert incoming value if applicable'''
-        if key == 'speed':
-            return round(value * 2.237) # m/s to mph
-        elif key == 'power':
-            return round(max(0, value / 746), 4) # Watt to hp
-        elif key == 'torque':
-            return round(max(0, value / 1.356), 4) # Newton meter to ft lbs
-        elif key in ['throttle', 'brake', 'clutch', 'handbrake']:
-            return round(value / 255 * 100) # Convert to percentage
-        elif key == 'suspension_travel':
-            return round(value * 39.37, 4) # Convert meter to inches
+        if key in self._conversions:
+            scale, minimum, ndigits = self._conversions[key]
+            value = value * scale
+            if minimum is not None:
+                value = max(minimum, value)
+            return round(value, ndigits)
         # Round any other floats to at most 4 decimal places
         if type(value) == float:
             return round(value, 4)
         return value
 
+    def _validate(self, packet):
+        '''Ensure the packet is the correct size for this version'''
+        size = len(packet)
+        expected_size = self._packet_lengths[self.packet_version]
+        if expected_size != size:
+            # Attempt to find a match for this packet size
+            match = self._packet_versions.get(size)
+            extra = f'- this looks like a {match} data packet.' if match is not None else ''
+            raise ValueError(f'Invalid {self.packet_version} packet length {size}, expected {expected_size} {extra}')
+
+    def _compile(self):
+        '''
+            Build the compiled decoder for this version: a precompiled
+            Struct, a record type and the conversion table
+        '''
+        packet_struct = Struct(self._packet_format)
+        record = namedtuple('DataPacketRecord', self.attributes)
+        field_types = dict(zip(self.attributes, self._get_field_types()))
+        return (packet_struct, record, record, *self._conversion_table(self.attributes, field_types))
+
+    def _compile_projection(self):
+        '''
+            Build the compiled decoder for a field projection: a Struct
+            which skips over every other field (so a single unpack_from
+            reads only the projected fields), a record type of just those
+            fields and their conversion table
+        '''
+        packet_format = '<'
+        skip = 0
+        for name, field_type in zip(self.attributes, self._get_field_types()):
+            if name not in self.fields:
+                skip += calcsize(f'<{field_type}')
+                continue
+            if skip:
+                packet_format += f'{skip}x'
+                skip = 0
+            packet_format += field_type
+
+        record = namedtuple('DataPacketRecord', self.fields)
+        field_types = dict(zip(self.attributes, self._get_field_types()))
+        return (Struct(packet_format), record, record, *self._conversion_table(self.fields, field_types))
+
+    def _conversion_table(self, names, field_types):
+        '''
+            Build the conversion table of the decoded fields: the
+            (index, scale, minimum) of each scaled field and the number of
+            digits to round each field to
+        '''
+        scales = []
+        ndigits = []
+        for index, name in enumerate(names):
+            if name in self._conversions:
+                scale, minimum, digits = self._conversions[name]
+                scales.append((index, scale, minimum))
+                ndigits.append(digits)
+            # Round any other floats to at most 4 decimal places
+            else:
+                ndigits.append(4 if field_types[name] == 'f' else None)
+        return tuple(scales), tuple(ndigits)
+
+    def _get_field_types(self):
+        '''Expand the packet format so each character maps to a single field'''
+        return ''.join(
+            char * int(count or 1)
+            for count, char in re.findall(r'(\d*)([a-zA-Z])', self._packet_format)
+        )
+
     def _get_default_attributes(self):
         '''Returns the default/sled attributes'''
         return [
@@ -169,4 +282,4 @@ class DataPacket():
         return [
             f'{key}_FL', f'{key}_FR',
             f'{key}_RL', f'{key}_RR'
-        ]
\ No newline at end of file
+        ]
@@ -0,0 +1,209 @@
+from array import array
+from bisect import bisect_right
+from glob import glob
+from os import makedirs, path, replace
+
+import numpy as np
+
+from util.analysis import track_key
+
+class ReferenceLap():
+    '''
+        ReferenceLap - a lap stored as the elapsed lap time at each
+        distance into the lap, so the time at any distance can be
+        interpolated
+    '''
+    def __init__(self, distance, elapsed, lap_time):
+        distance = np.asarray(distance, dtype=np.float64)
+        elapsed = np.asarray(elapsed, dtype=np.float64)
+        # Keep the first sample at each distance so distances strictly increase
+        distance = np.maximum.accumulate(distance)
+        distance, first = np.unique(distance, return_index=True)
+        self.distance = distance
+        self.elapsed = elapsed[first]
+        self.lap_time = float(lap_time)
+
+        # Plain lists are faster than arrays for per-packet lookups
+        self._distance = self.distance.tolist()
+        self._elapsed = self.elapsed.tolist()
+
+    def __len__(self):
+        return len(self._distance)
+
+    @classmethod
+    def from_analysis(cls, analysis, lap = None):
+        '''Build a reference from a lap (default: the best lap) of a SessionAnalysis'''
+        lap = lap or analysis.best_lap
+        if lap is None:
+            raise ValueError('No complete lap found to use as a reference')
+        data = analysis.data[lap['start']:lap['end']]
+        distance = data['dist_traveled'] - data['dist_traveled'][0]
+        return cls(distance, data['lap_time_current'], lap['time'])
+
+    @classmethod
+    def load(cls, file):
+        '''Load a reference lap saved with save()'''
+        with open(file, 'rb') as f:
+            values = np.load(f, allow_pickle=False)
+        return cls(values[1:, 0], values[1:, 1], values[0, 0])
+
+    def save(self, file):
+        '''Save the reference lap (atomically in case we are interrupted)'''
+        # The first row holds the lap time
+        values = np.vstack(([self.lap_time, 0], np.column_stack((self.distance, self.elapsed))))
+        with open(file + '.tmp', 'wb') as f:
+            np.save(f, values, allow_pickle=False)
+        replace(file + '.tmp', file)
+
+    def elapsed_at(self, distance, cursor = 0):
+        '''
+            Interpolate the elapsed time at a distance into the lap, starting
+            the search from a cursor (index) near the expected position.
+            Returns (elapsed, cursor) so the next lookup can continue from it
+        '''
+        distances = self._distance
+        last = len(distances) - 1
+        if cursor > last or distances[cursor] > distance:
+            # Jumped backwards (ex. a rewind), search from the start
+            cursor = max(0, bisect_right(distances, distance) - 1)
+        # Move forward to the sample before the distance (usually 0 - 2 steps)
+        while cursor < last and distances[cursor + 1] <= distance:
+            cursor += 1
+
+        if cursor == last:
+            return self._elapsed[last], cursor
+        d0, d1 = distances[cursor], distances[cursor + 1]
+        e0, e1 = self._elapsed[cursor], self._elapsed[cursor + 1]
+        return e0 + (distance - d0) * (e1 - e0) / (d1 - d0), cursor
+
+class LapDelta():
+    '''
+        LapDelta - live time delta against the best lap. The current lap is
+        sampled by distance and compared to the reference lap at the same
+        distance in amortised O(1) per packet. Reference laps are saved per
+        car and track so they are available again next session
+    '''
+    def __init__(self, reference_dir = None):
+        '''
+            Lap Delta
+            (reference_dir = directory to save and load reference laps in)
+        '''
+        self.reference_dir = reference_dir
+        self.clear()
+
+    def clear(self):
+        '''Forget the current lap and reference (ex. a new race)'''
+        self.reference = None
+        self.delta = None
+        self._car = None
+        self._line = None
+        self._track = None
+        self._lap_num = None
+        self._lap_start = None
+        self._last_time = None
+        self._last_distance = None
+        self._cursor = 0
+        self._distance = array('d')
+        self._elapsed = array('d')
+
+    def load(self, data):
+        '''Load a new data packet'''
+        # Position and distance are only in dash and fh4+ packets
+        if 'dist_traveled' not in data or 'position_x' not in data:
+            return
+        # Ignore packets sent while paused or in a menu
+        lap_time = data['lap_time_current']
+        if not data.get('active', 1) or lap_time == 0:
+            return
+
+        # A new lap starts when the lap number goes up by one
+        lap_num = data['lap_num']
+        if self._lap_num is None:
+            self._lap_num = lap_num
+        elif lap_num == self._lap_num + 1:
+            self._complete_lap(data)
+            self._start_lap(data)
+        elif lap_num != self._lap_num:
+            # Jumped to another lap (ex. a restart or a rewind over the line), wait for the next lap
+            self._lap_num = lap_num
+            self._lap_start = None
+        elif self._lap_start is None and lap_time < self._last_time and data['dist_traveled'] >= self._last_distance:
+            # The lap timer started within the lap (ex. a rolling start on the first lap)
+            self._start_lap(data)
+        self._last_time = lap_time
+        self._last_distance = data['dist_traveled']
+
+        # Laps are only timed once we have seen them start
+        if self._lap_start is None:
+            return
+        distance = data['dist_traveled'] - self._lap_start
+        if self._distance and distance < self._distance[-1]:
+            # Rewound within the lap, forget the samples after the rewound distance
+            keep = bisect_right(self._distance, distance)
+            del self._distance[keep:]
+            del self._elapsed[keep:]
+            self._cursor = 0
+        self._distance.append(distance)
+        self._elapsed.append(lap_time)
+
+        # Compare against the reference at the same distance
+        if self.reference is None:
+            self.delta = None
+            return
+        elapsed, self._cursor = self.reference.elapsed_at(distance, self._cursor)
+        self.delta = lap_time - elapsed
+
+    def _start_lap(self, data):
+        '''Start sampling a new lap from the start/finish line (Private)'''
+        self._lap_num = data['lap_num']
+        self._lap_start = data['dist_traveled']
+        self._cursor = 0
+        self._distance = array('d')
+        self._elapsed = array('d')
+
+        # Identify the car and the start/finish line to find a saved reference
+        car = data.get('car_ordinal_id')
+        line = (data['position_x'], data['position_z'])
+        if self._line is None or self._car != car or track_key(*line) != track_key(*self._line):
+            self._car = car
+            self._line = line
+            self.reference = self._load_reference()
+
+    def _complete_lap(self, data):
+        '''Use the finished lap as the reference if it is the best so far (Private)'''
+        # Ignore laps we did not see start
+        if self._lap_start is None or len(self._distance) < 2:
+            return
+        lap_time = data['lap_time_last']
+        if self.reference is not None and self.reference.lap_time <= lap_time:
+            return
+
+        self.reference = ReferenceLap(self._distance, self._elapsed, lap_time)
+        self._track = track_key(*self._line, self.reference.distance[-1])
+        self._save_reference()
+
+    def _reference_file(self):
+        '''File the reference for the current car and track is saved in (Private)'''
+        return path.join(self.reference_dir, f'{self._car}-{self._track}.npy')
+
+    def _load_reference(self):
+        '''Load the saved reference lap for the car and start/finish line (Private)'''
+        if self.reference_dir is None:
+            return None
+        # The lap distance is not known until a lap is completed, so match on the rest
+        self._track = None
+        files = glob(path.join(self.reference_dir, f'{self._car}-{track_key(*self._line)}_*.npy'))
+        if not files:
+            return None
+        # Use the fastest if references were saved for several lap distances
+        references = {file: ReferenceLap.load(file) for file in sorted(files)}
+        file = min(references, key=lambda file: references[file].lap_time)
+        self._track = path.basename(file)[len(f'{self._car}-'):-len('.npy')]
+        return references[file]
+
+    def _save_reference(self):
+        '''Save the reference lap for next session (Private)'''
+        if self.reference_dir is None:
+            return
+        makedirs(self.reference_dir, exist_ok=True)
+        self.reference.save(self._reference_file())
@@ -0,0 +1,158 @@
+from os import path, replace
+from struct import Struct
+from time import time
+
+import numpy as np
+
+from util.analysis import detect_version
+from util.batch_decoder import BatchDecoder
+from util.data_looper import DataLooper
+from util.data_packet import DataPacket
+from util.packet_cache import convert_row
+from util.recording import RecordingReader, RecordingWriter
+
+# Output formats by file extension
+_formats = {
+    '.parquet': 'parquet',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+}
+
+def packet_chunks(file, game_version = None, chunk_size = 65536):
+    '''
+        Stream the packets of a recording (.fzr, .json or .json.gz) as
+        buffers of up to chunk_size packets, returning the game version
+        and the generator of buffers
+    '''
+    if file.endswith('.fzr'):
+        reader = RecordingReader(file)
+        version = reader.packet_version
+        if game_version is not None and game_version != version:
+            reader.close()
+            raise ValueError(f'Recording is of type "{version}" but game version was set to "{game_version}".')
+        return version, _binary_chunks(reader, chunk_size)
+
+    version = game_version or detect_version(file)
+    return version, _json_chunks(file, version, chunk_size)
+
+def _binary_chunks(reader, chunk_size):
+    '''Join the blocks of a binary recording into chunks (Private)'''
+    chunk_bytes = chunk_size * reader.packet_size
+    buffer = bytearray()
+    try:
+        for block in range(len(reader.blocks)):
+            buffer += reader.read_block(block)
+            while len(buffer) >= chunk_bytes:
+                yield bytes(buffer[:chunk_bytes])
+                del buffer[:chunk_bytes]
+        if buffer:
+            yield bytes(buffer)
+    finally:
+        reader.close()
+
+def _json_chunks(file, version, chunk_size):
+    '''Pack the rows of a JSON recording into chunks (Private)'''
+    packet_struct = Struct(DataPacket(version=version)._packet_format)
+    buffer = bytearray()
+    count = 0
+    for row in DataLooper(file).rows():
+        buffer += packet_struct.pack(*convert_row(row, version))
+        count += 1
+        if count == chunk_size:
+            yield bytes(buffer)
+            buffer = bytearray()
+            count = 0
+    if buffer:
+        yield bytes(buffer)
+
+def convert_recording(input_file, output_file, game_version = None, codec = 'channel'):
+    '''
+        Convert a recording (.fzr, .json or .json.gz) into a binary
+        recording using a block codec, ex. to archive JSON recordings.
+        JSON recordings have no receive times so packets are timed at 60hz.
+        Returns the number of packets written
+    '''
+    if not output_file.endswith('.fzr'):
+        raise ValueError(f'Unsupported recording format: {output_file}, expected .fzr')
+    if path.abspath(input_file) == path.abspath(output_file):
+        raise ValueError('The input and output files must be different')
+
+    if input_file.endswith('.fzr'):
+        reader = RecordingReader(input_file)
+        version = reader.packet_version
+        packets = _timed_binary_packets(reader)
+    else:
+        version, chunks = packet_chunks(input_file, game_version)
+        packets = _timed_json_packets(chunks, DataPacket._packet_lengths[version])
+
+    # Write to a temporary file so an interrupted conversion is not mistaken for a complete one
+    with RecordingWriter(output_file + '.tmp', version=version, codec=codec) as writer:
+        for packet, timestamp in packets:
+            writer.write(packet, timestamp)
+    replace(output_file + '.tmp', output_file)
+    return writer.packets_written
+
+def _timed_binary_packets(reader):
+    '''Yield the packets of a binary recording, timed between each block's first and last times (Private)'''
+    try:
+        size = reader.packet_size
+        for block, (_, count, first, last) in enumerate(reader.blocks):
+            buffer = reader.read_block(block)
+            step = (last - first) / (count - 1) if count > 1 else 0
+            for i in range(count):
+                yield buffer[i * size:(i + 1) * size], first + i * step
+    finally:
+        reader.close()
+
+def _timed_json_packets(chunks, size):
+    '''Yield the packets of a JSON recording at 60hz (Private)'''
+    start = time()
+    count = 0
+    for chunk in chunks:
+        for offset in range(0, len(chunk), size):
+            yield chunk[offset:offset + size], start + count / 60
+            count += 1
+
+def export_recording(input_file, output_file, game_version = None, chunk_size = 65536, compression = 'zstd'):
+    '''
+        Export a recording to Parquet (.parquet) or Arrow IPC (.arrow or
+        .feather) with a named and typed column for every attribute, unit
+        conversions applied. The recording is written a chunk (row group)
+        at a time so memory use does not grow with the recording length.
+        Returns the number of packets written
+    '''
+    extension = output_file[output_file.rfind('.'):]
+    if extension not in _formats:
+        raise ValueError(f"Unsupported export format: {extension}, expected {', '.join(_formats)}")
+    # pyarrow is only needed when exporting, so it is not a requirement of the dashboard
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise Exception('pyarrow is required to export recordings - please run: python3 -m pip install pyarrow')
+
+    version, chunks = packet_chunks(input_file, game_version, chunk_size)
+    decoder = BatchDecoder(version)
+    schema = pa.schema(
+        [(name, pa.from_numpy_dtype(decoder.dtype.fields[name][0])) for name in decoder.attributes],
+        metadata={'game_version': version, 'source': input_file}
+    )
+
+    # Write to a temporary file so an interrupted export is not mistaken for a complete one
+    if _formats[extension] == 'parquet':
+        writer = pq.ParquetWriter(output_file + '.tmp', schema, compression=compression)
+    else:
+        writer = pa.ipc.new_file(output_file + '.tmp', schema, options=pa.ipc.IpcWriteOptions(compression=compression))
+
+    rows = 0
+    try:
+        for chunk in chunks:
+            data = decoder.decode(chunk)
+            columns = [pa.array(np.ascontiguousarray(data[name])) for name in decoder.attributes]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            rows += len(data)
+    finally:
+        writer.close()
+
+    replace(output_file + '.tmp', output_file)
+    return rows
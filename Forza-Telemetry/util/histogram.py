@@ -0,0 +1,81 @@
+class LatencyHistogram():
+    '''
+        LatencyHistogram - fixed-size log-linear (HDR-style) histogram of
+        nanosecond values. Each power of two is split into 16 sub-buckets
+        so recorded values keep ~6% precision at any magnitude while the
+        memory used stays constant. The counts can live in any writable
+        buffer (ex. shared memory) so other processes can read them.
+    '''
+    _sub_bits = 4
+    _sub_buckets = 1 << _sub_bits
+    # Values up to 2^40 ns (~18 minutes) are tracked, larger values are clamped
+    _max_bits = 40
+    buckets = (_max_bits - _sub_bits + 1) * _sub_buckets
+    size = buckets * 8
+
+    def __init__(self, buffer = None):
+        if buffer is None:
+            buffer = bytearray(self.size)
+        self._counts = memoryview(buffer)[:self.size].cast('Q')
+
+    def record(self, value):
+        '''Record a value (in nanoseconds)'''
+        self._counts[self._index(value)] += 1
+
+    def reset(self):
+        for i in range(self.buckets):
+            self._counts[i] = 0
+
+    def merge(self, other):
+        '''Add the counts of another histogram to this one'''
+        for i in range(self.buckets):
+            self._counts[i] += other._counts[i]
+
+    def tobytes(self):
+        '''Return a copy of the counts (ex. to send to another process)'''
+        return self._counts.tobytes()
+
+    @property
+    def count(self):
+        return sum(self._counts)
+
+    def percentile(self, percent):
+        '''Return the value (in nanoseconds) at a percentile (0 - 100)'''
+        total = self.count
+        if total == 0:
+            return 0
+        target = max(1, round(total * percent / 100))
+        seen = 0
+        for i in range(self.buckets):
+            seen += self._counts[i]
+            if seen >= target:
+                return self._value(i)
+        return self._value(self.buckets - 1)
+
+    def summary(self):
+        '''Return the common percentiles in milliseconds'''
+        return {
+            'count': self.count,
+            'p50_ms': round(self.percentile(50) / 1e6, 3),
+            'p90_ms': round(self.percentile(90) / 1e6, 3),
+            'p99_ms': round(self.percentile(99) / 1e6, 3),
+            'max_ms': round(self.percentile(100) / 1e6, 3),
+        }
+
+    def _index(self, value):
+        '''Find the bucket for a value (Private)'''
+        value = max(0, int(value))
+        if value < self._sub_buckets:
+            return value
+        if value.bit_length() > self._max_bits:
+            return self.buckets - 1
+        shift = value.bit_length() - self._sub_bits - 1
+        return (shift + 1) * self._sub_buckets + (value >> shift) - self._sub_buckets
+
+    def _value(self, index):
+        '''Return the midpoint of a bucket (Private)'''
+        if index < self._sub_buckets:
+            return index
+        shift = index // self._sub_buckets - 1
+        low = (self._sub_buckets + index % self._sub_buckets) << shift
+        return low + (1 << shift) // 2
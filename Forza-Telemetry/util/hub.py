@@ -0,0 +1,118 @@
+import asyncio
+
+from util.data_packet import DataPacket
+
+class Subscriber():
+    '''
+        Subscriber - a bounded queue of decoded packets for a single consumer
+        (recorder, dashboard, LED controller). When the queue is full, the
+        drop policy decides whether the oldest or the newest packet is lost
+        so a slow consumer never holds up the hub or other consumers.
+    '''
+    def __init__(self, rig = None, maxsize = 256, policy = 'drop_oldest', raw = False):
+        if policy not in ['drop_oldest', 'drop_newest']:
+            raise ValueError(f'Unsupported drop policy: {policy}, expected drop_oldest or drop_newest')
+        self.rig = rig
+        self.policy = policy
+        self.raw = raw
+        self.queue = asyncio.Queue(maxsize)
+        self.delivered = 0
+        self.dropped = 0
+
+    def offer(self, item):
+        '''Queue an item without blocking, applying the drop policy'''
+        if self.queue.full():
+            self.dropped += 1
+            if self.policy == 'drop_newest':
+                return
+            self.queue.get_nowait()
+        self.queue.put_nowait(item)
+        self.delivered += 1
+
+    async def get(self):
+        '''Wait for the next (rig, version, packet) item'''
+        return await self.queue.get()
+
+class TelemetryHub():
+    '''
+        TelemetryHub - receive packets from many rigs on one or more ports in
+        a single process. Rigs are identified by their source address and
+        each packet is decoded once and fanned out to the subscribers.
+        Listeners with the 'auto' version accept every game, detecting the
+        version of each packet from its length.
+    '''
+    def __init__(self, listeners):
+        '''
+            Telemetry Hub
+            (listeners = list of (host, port, version or auto))
+        '''
+        self.listeners = listeners
+        self.subscribers = []
+        self.rigs = {}
+        self.versions = {}
+        self.invalid = 0
+        self._transports = []
+        self._decoders = {}
+
+    def subscribe(self, rig = None, maxsize = 256, policy = 'drop_oldest', raw = False):
+        '''
+            Subscribe to packets from a single rig (or all rigs when None).
+            Raw subscribers receive the packet bytes instead of a record
+        '''
+        subscriber = Subscriber(rig, maxsize, policy, raw)
+        self.subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.remove(subscriber)
+
+    async def start(self):
+        '''Bind every listener to the running event loop'''
+        loop = asyncio.get_running_loop()
+        for host, port, version in self.listeners:
+            # Auto-detecting listeners need a decoder for every version
+            versions = DataPacket._packet_lengths if version == 'auto' else [version]
+            for packet_version in versions:
+                if packet_version not in self._decoders:
+                    self._decoders[packet_version] = DataPacket(version=packet_version)
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda version=version: _HubProtocol(self, version),
+                local_addr=(host, port)
+            )
+            self._transports.append(transport)
+
+    def close(self):
+        for transport in self._transports:
+            transport.close()
+        self._transports.clear()
+
+    def dispatch(self, packet, address, version):
+        '''Decode a datagram and fan it out to the matching subscribers'''
+        rig = address[0]
+        # Malformed packets (of the wrong or an unknown length) are counted and dropped
+        packet_version = DataPacket.detect_version(packet)
+        if packet_version is None or (version != 'auto' and packet_version != version):
+            self.invalid += 1
+            return
+        version = packet_version
+        decoder = self._decoders[version]
+
+        self.rigs[rig] = self.rigs.get(rig, 0) + 1
+        self.versions[version] = self.versions.get(version, 0) + 1
+        record = None
+        for subscriber in self.subscribers:
+            if subscriber.rig is not None and subscriber.rig != rig:
+                continue
+            # Only decode the packet once, and only if someone needs it
+            if not subscriber.raw and record is None:
+                record = decoder.decode(packet)
+            subscriber.offer((rig, version, packet if subscriber.raw else record))
+
+class _HubProtocol(asyncio.DatagramProtocol):
+    '''Datagram protocol forwarding packets to the hub (Private)'''
+    def __init__(self, hub, version):
+        self.hub = hub
+        self.version = version
+
+    def datagram_received(self, data, address):
+        self.hub.dispatch(data, address, self.version)
@@ -0,0 +1,146 @@
+from multiprocessing import resource_tracker, shared_memory
+import os
+from struct import Struct
+from time import monotonic_ns
+
+from util.histogram import LatencyHistogram
+
+# Stages timed for each packet:
+# handoff - received until published to the UI, parse - time taken to decode
+# it in the UI, paint - received until shown on screen
+STAGES = ['handoff', 'parse', 'paint']
+
+# Counters: frames painted, frames dropped
+_counters = Struct('<QQ')
+
+# Owner: process id of the creator, and the window currently recorded into
+_owner = Struct('<QB')
+
+def latency_name(port):
+    '''Name of the shared latency statistics of the dashboard listening on a port'''
+    return f'forza_latency_{port}'
+
+class LatencyStats():
+    '''
+        LatencyStats - rolling latency histograms for each stage of the
+        dashboard pipeline, kept in shared memory so the receiver process,
+        the UI and the command line all see the same numbers. Each stage
+        has two windows which take turns being recorded into, a summary
+        covers both.
+    '''
+    size = 2 * len(STAGES) * LatencyHistogram.size + _counters.size + _owner.size
+
+    def __init__(self, name, create = False, track = True):
+        '''
+            Create the shared statistics (create = True) or attach to
+            existing ones by name. Unrelated processes (ex. the command
+            line) attach with track = False so the memory is not released
+            when they exit
+        '''
+        if create:
+            try:
+                self._shm = shared_memory.SharedMemory(name=name, create=True, size=self.size)
+            except FileExistsError:
+                self._shm = self._reuse_stale(name)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            if not track:
+                resource_tracker.unregister(self._shm._name, 'shared_memory')
+        self.name = self._shm.name
+
+        # Two window histograms for each stage
+        buf = self._shm.buf
+        self._windows = {}
+        for i, stage in enumerate(STAGES):
+            offset = 2 * i * LatencyHistogram.size
+            self._windows[stage] = [
+                LatencyHistogram(buf[offset:offset + LatencyHistogram.size]),
+                LatencyHistogram(buf[offset + LatencyHistogram.size:offset + 2 * LatencyHistogram.size]),
+            ]
+        self._counters_offset = 2 * len(STAGES) * LatencyHistogram.size
+        self._owner_offset = self._counters_offset + _counters.size
+        self._window_offset = self._owner_offset + _owner.size - 1
+
+        if create:
+            _owner.pack_into(buf, self._owner_offset, os.getpid(), 0)
+
+    def _reuse_stale(self, name):
+        '''
+            Attach to statistics left behind by a dashboard which did not
+            exit cleanly, clearing them. Statistics still owned by a running
+            process are never shared (Private)
+        '''
+        shm = shared_memory.SharedMemory(name=name)
+        pid = 0
+        if shm.size >= self.size:
+            pid, _ = _owner.unpack_from(shm.buf, self.size - _owner.size)
+        try:
+            if pid and pid != os.getpid():
+                os.kill(pid, 0)
+                shm.close()
+                raise FileExistsError(f'Latency statistics {name} are in use by process {pid}')
+        except ProcessLookupError:
+            pass
+        except PermissionError:
+            shm.close()
+            raise FileExistsError(f'Latency statistics {name} are in use by process {pid}')
+        shm.buf[:self.size] = bytes(self.size)
+        return shm
+
+    def record(self, stage, start, end = None):
+        '''
+            Record the time from start until end (or now) for a stage, both
+            in monotonic_ns. Each stage must only be recorded by one process
+        '''
+        if end is None:
+            end = monotonic_ns()
+        self._windows[stage][self._shm.buf[self._window_offset]].record(end - start)
+
+    def frame(self, dropped = 0):
+        '''Count a painted frame, and any frames dropped before it'''
+        frames, dropped_frames = self.counters
+        _counters.pack_into(self._shm.buf, self._counters_offset, frames + 1, dropped_frames + dropped)
+
+    def roll(self):
+        '''
+            Start a new window, discarding the oldest one. The window not
+            being recorded into is cleared and then switched to, so values
+            recorded by other processes during a roll are not lost
+        '''
+        window = 1 - self._shm.buf[self._window_offset]
+        for stage in STAGES:
+            self._windows[stage][window].reset()
+        self._shm.buf[self._window_offset] = window
+
+    def histogram(self, stage):
+        '''Return a copy of the histogram of a stage over both windows'''
+        histogram = LatencyHistogram()
+        for window in self._windows[stage]:
+            histogram.merge(window)
+        return histogram
+
+    @property
+    def counters(self):
+        '''Frames painted and dropped'''
+        return _counters.unpack_from(self._shm.buf, self._counters_offset)
+
+    def summary(self):
+        '''Return the latency percentiles of each stage and the frame counters'''
+        frames, dropped_frames = self.counters
+        summary = {stage: self.histogram(stage).summary() for stage in STAGES}
+        summary['frames'] = frames
+        summary['dropped_frames'] = dropped_frames
+        return summary
+
+    def close(self):
+        '''Detach from the shared memory'''
+        # Release the views into the buffer before closing it
+        for windows in self._windows.values():
+            for histogram in windows:
+                histogram._counts.release()
+        self._windows.clear()
+        self._shm.close()
+
+    def unlink(self):
+        '''Release the shared memory (creator only)'''
+        self._shm.unlink()
@@ -3,8 +3,14 @@ from adafruit_aw9523 import AW9523
 from board import I2C
 from json import load
 from os import path
+from threading import Event, Thread
 from time import sleep
 
+from util.data_packet import DataPacket
+from util.ring_buffer import LatestPacketSlot, PacketRingBuffer
+from util.scheduler import PeriodicScheduler
+from util.telemetry import Telemetry
+
 # Instantiate the I2C interface
 i2c = I2C()
 
@@ -17,6 +23,39 @@ class RGBColor():
     yellow = (10, 10, 0)
     orange = (20, 5, 0)
 
+# Frames are the colors of LEDs 1-5 on a controller
+OFF_FRAME = (RGBColor.off,) * 5
+
+def _bar_frame(count, color, extra = 0, extra_color = RGBColor.off):
+    '''Build a frame lighting `count` LEDs and then `extra` LEDs'''
+    return (color,) * count + (extra_color,) * extra + (RGBColor.off,) * (5 - count - extra)
+
+# Tachometer bands: (minimum engine load %, frame) - None flashes at the limit
+TACHOMETER_BANDS = (
+    (85, None),
+    (80, _bar_frame(3, RGBColor.green, 2, RGBColor.blue)),
+    (70, _bar_frame(3, RGBColor.green, 1, RGBColor.blue)),
+    (60, _bar_frame(3, RGBColor.green)),
+    (50, _bar_frame(2, RGBColor.green)),
+    (40, _bar_frame(1, RGBColor.green)),
+    (0, OFF_FRAME),
+)
+
+# Wheel slip bands: (minimum wheel slip, frame) - None flashes at the limit
+WHEEL_SLIP_BANDS = (
+    (40, None),
+    (30, _bar_frame(3, RGBColor.blue)),
+    (20, _bar_frame(2, RGBColor.blue)),
+    (10, _bar_frame(1, RGBColor.blue)),
+    (0, OFF_FRAME),
+)
+
+# AW9523 constant current (dimming) register for each pin
+_current_registers = tuple(
+    0x24 + pin if pin <= 7 else 0x20 + pin - 8 if pin <= 11 else 0x2C + pin - 12
+    for pin in range(16)
+)
+
 class LED():
     '''Individual LED controller class'''
     def __init__(self, driver, red_pin, green_pin, blue_pin):
@@ -34,6 +73,14 @@ class LED():
         self.driver.set_constant_current(self.pins['g'], min(255, green))
         self.driver.set_constant_current(self.pins['b'], min(255, blue))
 
+    def registers(self, red, green, blue):
+        '''Return the (register, value) pairs to set this LED to an RGB value'''
+        return (
+            (_current_registers[self.pins['r']], min(255, red)),
+            (_current_registers[self.pins['g']], min(255, green)),
+            (_current_registers[self.pins['b']], min(255, blue))
+        )
+
     def _validate_pins(self):
         '''Validate the supplied pins passed and ensure they are valid'''
         for pin in [self.pins['r'], self.pins['g'], self.pins['b']]:
@@ -43,12 +90,14 @@ class LED():
 
 class DashLEDController():
     '''Dashboard LED Controller'''
-    _initialized = False
-    _frames_at_limit = {}
-    _led_state = {}
-
     def __init__(self, telemetry):
         self.telemetry = telemetry
+        self._initialized = False
+        self._frames_at_limit = {}
+        self._led_state = {}
+        # Number of I2C transactions performed
+        self.transactions = 0
+
         # Check if we have a controller configuration
         if not path.isfile('controller_config.json'):
             print('Error: controller_config.json is missing, unable to initialize devices.')
@@ -61,7 +110,6 @@ class DashLEDController():
         # Instantiate library class for each controller
         for controller, config in self.controllers.items():
             self._frames_at_limit[controller] = 0
-            self._led_state[controller] = {}
             config['driver'] = AW9523(i2c, int(config['device'], 16)) # Real
             #config['driver'] = AW9523(None, config['device'], None) # Mock
             config['driver'].LED_modes = 0xFFFF
@@ -71,7 +119,7 @@ class DashLEDController():
             config['leds'] = {}
             for led, pins in config['pins'].items():
                 config['leds'][led] = LED(config['driver'], *pins)
-                self._led_state[controller][led] = (0, 0, 0)
+            self._led_state[controller] = OFF_FRAME
 
         # Set a flag so we know we can set LEDs without any errors
         self._initialized = True
@@ -98,28 +146,40 @@ class DashLEDController():
         elif type(led_nums) != list:
             raise Exception('Must pass a str, int or list for led_nums')
 
-        # Loop through each provided pin number
+        # Build the new frame from the current state
+        frame = list(self._led_state[controller])
         for led_num in led_nums:
             # Ensure the LED number provided is valid
-            led_num = str(led_num)
-            leds = self.controllers[controller]['leds']
-            if led_num not in leds.keys():
+            if str(led_num) not in self.controllers[controller]['leds'].keys():
                 raise Exception(f'Error: Invalid LED number provided ({controller}): {led_num}')
+            frame[int(led_num) - 1] = (red, green, blue)
+        self.set_frame(controller, tuple(frame))
+
+    def set_frame(self, controller, frame):
+        '''
+            Set all 5 LEDs of a controller, writing only the changed
+            registers to the driver in as few I2C transactions as possible
+        '''
+        state = self._led_state[controller]
+        if state == frame:
+            return
+
+        # Collect the registers of each LED which changed
+        leds = self.controllers[controller]['leds']
+        registers = {}
+        for led_num, (current, color) in enumerate(zip(state, frame), 1):
+            if current != color:
+                registers.update(leds[str(led_num)].registers(*color))
 
-            # Set the color via the utility function
-            colors = (red, green, blue)
-            if self._led_state[controller][led_num] != colors:
-                leds[led_num].set_color(*colors)
-                self._led_state[controller][led_num] = colors
+        self._write_registers(self.controllers[controller]['driver'], registers)
+        self._led_state[controller] = frame
 
     def clear_status(self):
         '''Turn off all controllers LEDs'''
         if not self._initialized:
             return
         for controller in self.controllers.keys():
-            # Loop through each pin in each controller and turn it off
-            for pin in range(1, 6):
-                self.set_led_value(controller, pin, 0, 0, 0)
+            self.set_frame(controller, OFF_FRAME)
 
     def update_status(self):
         '''Update LED status based on current packet data'''
@@ -139,74 +199,105 @@ class DashLEDController():
                     sleep(0.05)
                 self.clear_status()
 
+    def _band_frame(self, controller, bands, value, limit_color):
+        '''Find the frame for a value in a band table (Private)'''
+        for minimum, frame in bands:
+            if value >= minimum:
+                break
+        else:
+            frame = OFF_FRAME
+
+        # Reset our limit counter if it has decreased
+        if frame is not None:
+            self._frames_at_limit[controller] = 0
+            return frame
+
+        # Every 3 frames flash the LEDs so it is
+        # more obvious we are at our limit
+        self._frames_at_limit[controller] += 1
+        current = 15 if self._frames_at_limit[controller] % 3 == 0 else 30
+        return (tuple(current if channel else 0 for channel in limit_color),) * 5
+
     def _set_wheel_slip_led_status(self):
         '''Set the wheel slip LED status (Private)'''
         wheel_slip = self.telemetry.wheel_slip
         for side in wheel_slip.keys():
             controller = f'wheel_{side}'
-            # Reset our limit counter if it has decreased
-            if wheel_slip[side] < 40:
-                self._frames_at_limit[controller] = 0
-
-            if wheel_slip[side] < 10:
-                # Disable all other LEDs
-                self.set_led_value(controller, list(range(1, 6)), *RGBColor.off)
-            if wheel_slip[side] >= 10 and wheel_slip[side] < 20:
-                self.set_led_value(controller, 1, *RGBColor.blue)
-                self.set_led_value(controller, list(range(2, 6)), *RGBColor.off)
-            elif wheel_slip[side] >= 20 and wheel_slip[side] < 30:
-                self.set_led_value(controller, [1, 2], *RGBColor.blue)
-                self.set_led_value(controller, list(range(3, 6)), *RGBColor.off)
-            elif wheel_slip[side] >= 30 and wheel_slip[side] < 40:
-                self.set_led_value(controller, list(range(1, 4)), *RGBColor.blue)
-                self.set_led_value(controller, [4, 5], *RGBColor.off)
-            elif wheel_slip[side] >= 20 and wheel_slip[side] < 30:
-                self.set_led_value(controller, list(range(1, 5)), *RGBColor.blue)
-                self.set_led_value(controller, 5, *RGBColor.off)
-            elif wheel_slip[side] >= 30 and wheel_slip[side] < 40:
-                self.set_led_value(controller, list(range(1, 6)), *RGBColor.blue)
-            elif wheel_slip[side] >= 40:
-                self._frames_at_limit[controller] += 1
-                # Every 3 packets (0.03 sec) flash the LEDs
-                # so it is more obvious we are at our limit
-                if self._frames_at_limit[controller] % 3 == 0:
-                    current = 15
-                else:
-                    current = 30
-                self.set_led_value(controller, list(range(1, 6)), 0, 0, current)
+            frame = self._band_frame(controller, WHEEL_SLIP_BANDS, wheel_slip[side], RGBColor.blue)
+            self.set_frame(controller, frame)
 
     def _set_tachometer_led_status(self):
         '''Set the tachometer LED status (Private)'''
         load = self.telemetry.engine_load * 100
-        # Reset our limit counter if it has decreased
-        if load < 85:
-            self._frames_at_limit['tachometer'] = 0
-
-        if load < 40:
-            # Disable all other LEDs
-            self.set_led_value('tachometer', list(range(1, 6)), *RGBColor.off)
-        if load >= 40 and load < 50:
-            self.set_led_value('tachometer', 1, *RGBColor.green)
-            self.set_led_value('tachometer', list(range(2, 6)), *RGBColor.off)
-        elif load >= 50 and load < 60:
-            self.set_led_value('tachometer', [1, 2], *RGBColor.green)
-            self.set_led_value('tachometer', list(range(3, 6)), *RGBColor.off)
-        elif load >= 60 and load < 70:
-            self.set_led_value('tachometer', list(range(1, 4)), *RGBColor.green)
-            self.set_led_value('tachometer', list(range(4, 6)), *RGBColor.off)
-        elif load >= 70 and load < 80:
-            self.set_led_value('tachometer', list(range(1, 4)), *RGBColor.green)
-            self.set_led_value('tachometer', 4, *RGBColor.blue)
-            self.set_led_value('tachometer', 5, *RGBColor.off)
-        elif load >= 80 and load < 85:
-            self.set_led_value('tachometer', list(range(1, 4)), *RGBColor.green)
-            self.set_led_value('tachometer', [4, 5], *RGBColor.blue)
-        elif load >= 85:
-            self._frames_at_limit['tachometer'] += 1
-            # Every 3 packets (~0.03 sec) flash the LEDs
-            # so it is more obvious we are at our rev limit
-            if self._frames_at_limit['tachometer'] % 3 == 0:
-                current = 15
+        frame = self._band_frame('tachometer', TACHOMETER_BANDS, load, RGBColor.red)
+        self.set_frame('tachometer', frame)
+
+    def _write_registers(self, driver, registers):
+        '''
+            Write register values to a driver, combining consecutive
+            registers into a single (auto-incrementing) I2C write (Private)
+        '''
+        run = []
+        for register in sorted(registers):
+            if run and register != run[0] + len(run) - 1:
+                self._write_register_run(driver, run)
+                run = []
+            if not run:
+                run = [register]
+            run.append(registers[register])
+        if run:
+            self._write_register_run(driver, run)
+
+    def _write_register_run(self, driver, run):
+        '''Write a start register followed by its values (Private)'''
+        with driver.i2c_device as device:
+            device.write(bytes(run))
+        self.transactions += 1
+
+class LEDRenderLoop(Thread):
+    '''
+        Update the LED controllers from their own thread at packet rate,
+        reading the newest packet straight from shared memory so slow I2C
+        writes never block the UI (and the UI never slows down the LEDs)
+    '''
+    # Packet fields used by the LEDs (and to track laps)
+    fields = [
+        'active', 'engine_max_rpm', 'engine_idle_rpm', 'engine_current_rpm', 'car_drivetrain_id',
+        'wheel_combined_slip_FL', 'wheel_combined_slip_FR', 'wheel_combined_slip_RL', 'wheel_combined_slip_RR',
+        'lap_num', 'dist_traveled', 'fuel', 'lap_time_current', 'lap_time_last'
+    ]
+
+    def __init__(self, ring_name, game_version, coalesce = False, rate_hz = 60):
+        super().__init__(daemon=True)
+        # Only decode the fields we use (sled packets do not have the lap fields)
+        attributes = DataPacket(version=game_version).attributes
+        self.packet = DataPacket(version=game_version, fields=[name for name in self.fields if name in attributes])
+        self.telemetry = Telemetry()
+        self.led_controller = DashLEDController(self.telemetry)
+        # Shift lights do not need sub-millisecond precision, so never spin (holding the GIL from the UI)
+        self.scheduler = PeriodicScheduler(1 / rate_hz, spin=0)
+        self._ring = LatestPacketSlot(ring_name) if coalesce else PacketRingBuffer(ring_name)
+        self._stop_event = Event()
+
+    def run(self):
+        self.scheduler.reset()
+        while not self._stop_event.is_set():
+            packet = self._ring.read_latest()
+            if packet is None:
+                self.led_controller.clear_status()
             else:
-                current = 30
-            self.set_led_value('tachometer', list(range(1, 6)), current, 0, 0)
+                self.telemetry.load(self.packet.decode(packet)._asdict())
+                # Turn off the LEDs if we are not in an active race
+                if not self.telemetry.data['active']:
+                    self.led_controller.clear_status()
+                else:
+                    self.led_controller.update_status()
+            self.scheduler.wait()
+
+        self.led_controller.clear_status()
+        self._ring.close()
+
+    def stop(self):
+        '''Stop the loop and turn off the LEDs'''
+        self._stop_event.set()
+        self.join()
@@ -0,0 +1,98 @@
+import hashlib
+from os import makedirs, path, replace
+from struct import Struct
+from tempfile import mkstemp
+
+from util.data_looper import DataLooper
+from util.data_packet import DataPacket
+
+def convert_row(row, game_version):
+    '''
+        Validate a recorded row against the game version and truncate it
+        as needed for older versions for backwards compatibility
+    '''
+    # Prevent older recordings being used on newer versions
+    if game_version == 'dash':
+        if len(row) == 58:
+            raise Exception('Data is of "sled" format but game version was set to "dash".')
+    elif game_version == 'fh4+' and len(row) != 89:
+        data_type = 'unknown'
+        if len(row) == 58:
+            data_type = 'sled'
+        elif len(row) == 85:
+            data_type = 'dash'
+        raise Exception(f'Data is of type "{data_type}" but game version was set to "fh4+".')
+
+    # Truncate the data as needed for older versions
+    if len(row) == 89: # FH4+ field length
+        if game_version == 'sled':
+            row = row[0:58]
+        elif game_version == 'dash':
+            row = row[0:58] + row[61:88]
+    return row
+
+def file_hash(file):
+    '''Return the sha256 hash of a file's contents'''
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class PacketCache():
+    '''
+        PacketCache - convert a recording once into a contiguous buffer of
+        ready-to-send data packets for a game version. The buffer can be
+        cached on disk, keyed by the recording's content hash and version.
+    '''
+    def __init__(self, file, game_version, cache_dir = None):
+        self.file = file
+        self.packet_version = game_version
+        self.packet_size = DataPacket._packet_lengths[game_version]
+
+        # Re-use a previously prepared buffer if available
+        cache_file = None
+        if cache_dir is not None:
+            cache_file = path.join(cache_dir, f'{self._file_hash()}-{game_version}.bin')
+            if path.isfile(cache_file):
+                with open(cache_file, 'rb') as f:
+                    buffer = f.read()
+                # Rebuild caches which are empty or truncated (not whole packets)
+                if len(buffer) > 0 and len(buffer) % self.packet_size == 0:
+                    self.buffer = buffer
+                    return
+
+        self.buffer = self._prepare()
+
+        # Save the buffer for next time (atomically in case we are interrupted)
+        if cache_file is not None:
+            # Use a unique temporary file as several processes may build the same cache at once
+            makedirs(cache_dir, exist_ok=True)
+            fd, temp_file = mkstemp(dir=cache_dir, suffix='.tmp')
+            with open(fd, 'wb') as f:
+                f.write(self.buffer)
+            replace(temp_file, cache_file)
+
+    def __len__(self):
+        return len(self.buffer) // self.packet_size
+
+    def __getitem__(self, index):
+        '''Return a packet as a memoryview of the buffer'''
+        if index < 0 or index >= len(self):
+            raise IndexError(f'Packet index out of range: {index}')
+        start = index * self.packet_size
+        return memoryview(self.buffer)[start:start + self.packet_size]
+
+    def _prepare(self):
+        '''Convert and pack every row of the recording (Private)'''
+        packet_struct = Struct(DataPacket(version=self.packet_version)._packet_format)
+        buffer = bytearray()
+        for row in DataLooper(self.file).rows():
+            buffer += packet_struct.pack(*convert_row(row, self.packet_version))
+        if len(buffer) == 0:
+            raise ValueError(f'No data found in file: {self.file}')
+        return bytes(buffer)
+
+    def _file_hash(self):
+        '''Hash the contents of the recording (Private)'''
+        return file_hash(self.file)
@@ -0,0 +1,100 @@
+from select import select
+import socket
+from struct import unpack
+import sys
+from time import monotonic_ns
+
+# Linux reports the number of datagrams dropped by the kernel (due to a
+# full receive buffer) as ancillary data when this option is enabled
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40 if sys.platform.startswith('linux') else None)
+
+class BatchReceiver():
+    '''
+        BatchReceiver - drain every pending datagram from a UDP socket per
+        wakeup into a preallocated buffer pool, so bursts of packets are
+        handled in batches rather than one blocking call at a time.
+    '''
+    def __init__(self, host, port, batch_size = 64, buffer_size = 1024, receive_buffer = 4 * 1024 * 1024, timeout = None):
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.timeout = timeout
+
+        # Create an ipv4 datagram-based socket with a larger kernel buffer and bind
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        self.sock.bind((host, port))
+        # Waiting is handled by select so the socket is never blocking
+        self.sock.setblocking(False)
+
+        # Request kernel drop counts if supported
+        self._ancillary_size = 0
+        if SO_RXQ_OVFL is not None:
+            try:
+                self.sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self._ancillary_size = socket.CMSG_SPACE(4)
+            except OSError:
+                pass
+
+        # Preallocate the buffer pool and a view for each buffer
+        self._pool = bytearray(batch_size * buffer_size)
+        view = memoryview(self._pool)
+        self._views = [view[i * buffer_size:(i + 1) * buffer_size] for i in range(batch_size)]
+
+        # Time each datagram of the last batch was received (monotonic_ns)
+        self.received = []
+
+        # Counters
+        self.packets = 0
+        self.batches = 0
+        self.max_batch = 0
+        self.truncated = 0
+        self.kernel_drops = 0
+
+    def receive(self):
+        '''
+            Wait for at least one datagram and return every pending datagram
+            as a list of memoryviews (valid until the next call). Returns an
+            empty list if the timeout is reached
+        '''
+        batch = []
+        self.received = []
+        if not select([self.sock], [], [], self.timeout)[0]:
+            return batch
+
+        # Drain the socket until it would block or the pool is full
+        while len(batch) < self.batch_size:
+            view = self._views[len(batch)]
+            try:
+                size, ancillary, msg_flags, _ = self.sock.recvmsg_into([view], self._ancillary_size)
+            except BlockingIOError:
+                break
+
+            for level, kind, data in ancillary:
+                if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL:
+                    self.kernel_drops = unpack('=I', data[:4])[0]
+            if msg_flags & socket.MSG_TRUNC:
+                self.truncated += 1
+                continue
+            batch.append(view[:size])
+            self.received.append(monotonic_ns())
+
+        if batch:
+            self.packets += len(batch)
+            self.batches += 1
+            self.max_batch = max(self.max_batch, len(batch))
+        return batch
+
+    @property
+    def stats(self):
+        '''Return the receive counters'''
+        return {
+            'packets': self.packets,
+            'batches': self.batches,
+            'average_batch': round(self.packets / self.batches, 2) if self.batches else 0,
+            'max_batch': self.max_batch,
+            'truncated': self.truncated,
+            'kernel_drops': self.kernel_drops,
+        }
+
+    def close(self):
+        self.sock.close()
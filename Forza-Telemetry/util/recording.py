@@ -0,0 +1,250 @@
+import mmap
+from os import path
+from struct import Struct
+from time import time
+import zlib
+
+from util.codec import ChannelCodec
+from util.data_packet import DataPacket
+
+# File header: magic, format version, packet version, packet size,
+# packets per block, creation timestamp (followed by the packet format
+# and, from format version 2, the block codec)
+_file_header = Struct('<4sH8sHId')
+_format_length = Struct('<H')
+_codec_header = Struct('<B')
+
+# Block header: compressed length, packet count, first/last timestamp
+_block_header = Struct('<IIdd')
+
+# Block index entry: block offset, packet count, first/last timestamp
+_index_entry = Struct('<QIdd')
+
+# Footer: index offset, block count, magic
+_footer = Struct('<QI4s')
+
+_magic = b'FZRC'
+_index_magic = b'FZRI'
+_format_version = 2
+
+# Block codecs: whole-block zlib, or per-channel delta/XOR (see ChannelCodec)
+_codecs = {'zlib': 0, 'channel': 1}
+
+class RecordingWriter():
+    '''
+        RecordingWriter - stream raw Forza Data Packets to disk in fixed-size
+        compressed blocks so memory usage stays constant while recording.
+    '''
+    def __init__(self, file, version = 'sled', block_size = 1024, compression = 6, codec = 'channel'):
+        self.file = file
+        self.packet_version = version
+        self.block_size = block_size
+        self.compression = compression
+        self.codec = codec
+        self.packet = DataPacket(version=version)
+        self.packet_size = DataPacket._packet_lengths[version]
+        self.packets_written = 0
+
+        # Ensure a valid block size is passed
+        if self.block_size <= 0:
+            raise ValueError('Block size must be greater than zero')
+        if self.codec not in _codecs:
+            raise ValueError(f"Unsupported codec: {self.codec}, expected {', '.join(_codecs)}")
+        self._codec = ChannelCodec(self.packet._packet_format, compression) if codec == 'channel' else None
+
+        # Current (uncompressed) block and the index of flushed blocks
+        self._block = bytearray()
+        self._block_count = 0
+        self._block_first = None
+        self._block_last = None
+        self._index = []
+
+        # Write the header, including the field layout
+        self._f = open(self.file, 'wb')
+        packet_format = self.packet._packet_format.encode('ascii')
+        self._f.write(_file_header.pack(
+            _magic, _format_version, version.encode('ascii'),
+            self.packet_size, self.block_size, time()
+        ))
+        self._f.write(_format_length.pack(len(packet_format)) + packet_format)
+        self._f.write(_codec_header.pack(_codecs[self.codec]))
+        self._f.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def write(self, packet, timestamp = None):
+        '''Append a raw data packet to the recording'''
+        self.packet._validate(packet)
+        timestamp = time() if timestamp is None else timestamp
+
+        if self._block_count == 0:
+            self._block_first = timestamp
+        self._block_last = timestamp
+        self._block += packet
+        self._block_count += 1
+        self.packets_written += 1
+
+        # Flush the block to disk once it is full
+        if self._block_count == self.block_size:
+            self._flush_block()
+
+    def close(self):
+        '''Flush any remaining packets and write the block index'''
+        if self._f.closed:
+            return
+        self._flush_block()
+
+        # Write the block index followed by the footer
+        index_offset = self._f.tell()
+        for entry in self._index:
+            self._f.write(_index_entry.pack(*entry))
+        self._f.write(_footer.pack(index_offset, len(self._index), _index_magic))
+        self._f.close()
+
+    def _flush_block(self):
+        '''Compress and write the current block (Private)'''
+        if self._block_count == 0:
+            return
+        if self._codec is not None:
+            compressed = self._codec.encode(self._block)
+        else:
+            compressed = zlib.compress(bytes(self._block), self.compression)
+        self._index.append((self._f.tell(), self._block_count, self._block_first, self._block_last))
+        self._f.write(_block_header.pack(len(compressed), self._block_count, self._block_first, self._block_last))
+        self._f.write(compressed)
+        self._f.flush()
+
+        self._block.clear()
+        self._block_count = 0
+
+class RecordingReader():
+    '''
+        RecordingReader - memory-map a binary recording and provide random
+        access to its packets using the block index.
+    '''
+    def __init__(self, file):
+        self.file = file
+
+        # Ensure the file passed is valid
+        if not path.isfile(self.file):
+            raise ValueError(f'Invalid file path: {self.file}')
+
+        with open(self.file, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Parse the header and field layout
+        if len(self._mmap) < _file_header.size or self._mmap[:4] != _magic:
+            raise ValueError(f'Invalid recording file: {self.file}')
+        _, format_version, version, self.packet_size, self.block_size, self.created = \
+            _file_header.unpack_from(self._mmap, 0)
+        if format_version not in (1, _format_version):
+            raise ValueError(f'Unsupported recording format version: {format_version}')
+        self.packet_version = version.rstrip(b'\x00').decode('ascii')
+        offset = _file_header.size
+        format_length, = _format_length.unpack_from(self._mmap, offset)
+        offset += _format_length.size
+        self.packet_format = self._mmap[offset:offset + format_length].decode('ascii')
+        offset += format_length
+
+        # Recordings before format version 2 are always zlib compressed
+        self.codec = 'zlib'
+        if format_version >= 2:
+            codec, = _codec_header.unpack_from(self._mmap, offset)
+            offset += _codec_header.size
+            codecs = {value: name for name, value in _codecs.items()}
+            if codec not in codecs:
+                raise ValueError(f'Unsupported recording codec: {codec}')
+            self.codec = codecs[codec]
+        self._data_offset = offset
+
+        self.packet = DataPacket(version=self.packet_version)
+        self.attributes = self.packet.attributes
+        self._struct = Struct(self.packet_format)
+        self._codec = ChannelCodec(self.packet_format) if self.codec == 'channel' else None
+
+        # Load the block index (or rebuild it if the recording was interrupted)
+        self._index = self._load_index()
+        self._block_starts = []
+        total = 0
+        for _, count, _, _ in self._index:
+            self._block_starts.append(total)
+            total += count
+        self._length = total
+
+        # Cache of the last decompressed block
+        self._cached_block = None
+        self._cached_data = None
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        '''Return the raw (unconverted) values of a packet'''
+        return self._struct.unpack(self.get_packet(index))
+
+    def __iter__(self):
+        '''Iterate the raw values of each packet'''
+        for block in range(len(self._index)):
+            yield from self._struct.iter_unpack(self.read_block(block))
+
+    def close(self):
+        self._mmap.close()
+
+    @property
+    def blocks(self):
+        '''Block index entries (offset, count, first timestamp, last timestamp)'''
+        return self._index
+
+    def get_packet(self, index):
+        '''Return the raw bytes of a single packet'''
+        if index < 0:
+            index += self._length
+        if index < 0 or index >= self._length:
+            raise IndexError(f'Packet index out of range: {index}')
+        block = self._find_block(index)
+        start = (index - self._block_starts[block]) * self.packet_size
+        return self.read_block(block)[start:start + self.packet_size]
+
+    def read_block(self, block):
+        '''Return the decompressed packets of a block as one contiguous buffer'''
+        if self._cached_block != block:
+            offset = self._index[block][0]
+            length, count = _block_header.unpack_from(self._mmap, offset)[:2]
+            start = offset + _block_header.size
+            if self._codec is not None:
+                self._cached_data = self._codec.decode(self._mmap[start:start + length], count)
+            else:
+                self._cached_data = zlib.decompress(self._mmap[start:start + length])
+            self._cached_block = block
+        return self._cached_data
+
+    def _find_block(self, index):
+        '''Find the block containing a packet index (Private)'''
+        # Only the last block of a recording can be partially filled
+        return index // self.block_size
+
+    def _load_index(self):
+        '''Read the block index from the footer or scan the blocks (Private)'''
+        size = len(self._mmap)
+        if size >= self._data_offset + _footer.size:
+            index_offset, block_count, magic = _footer.unpack_from(self._mmap, size - _footer.size)
+            if magic == _index_magic and index_offset + block_count * _index_entry.size + _footer.size == size:
+                return [
+                    _index_entry.unpack_from(self._mmap, index_offset + i * _index_entry.size)
+                    for i in range(block_count)
+                ]
+
+        # The index is missing, so walk each complete block
+        index = []
+        offset = self._data_offset
+        while offset + _block_header.size <= size:
+            length, count, first, last = _block_header.unpack_from(self._mmap, offset)
+            if offset + _block_header.size + length > size:
+                break
+            index.append((offset, count, first, last))
+            offset += _block_header.size + length
+        return index
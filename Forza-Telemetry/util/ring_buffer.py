@@ -0,0 +1,220 @@
+from multiprocessing import shared_memory
+from struct import Struct
+from time import sleep
+
+from util.data_packet import DataPacket
+
+# Buffer header: next sequence number, slot count, slot payload size
+_header = Struct('<QII')
+
+# Slot header: sequence number, packet length, receive timestamp (ns)
+_slot_header = Struct('<QIQ')
+
+# Sequence numbers and lengths are published with a single slice
+# assignment as Struct.pack_into zeroes the fields before writing them
+_sequence = Struct('<Q')
+_length = Struct('<I')
+_timestamp = Struct('<Q')
+_timestamp_offset = _sequence.size + _length.size
+
+class PacketRingBuffer():
+    '''
+        PacketRingBuffer - lock-free single producer/multi consumer ring of
+        raw data packets in shared memory. Each slot is tagged with the
+        sequence number of the packet it holds so readers can detect when
+        a slot was overwritten while they were reading it.
+    '''
+    def __init__(self, name = None, create = False, slots = 256, slot_size = max(DataPacket._packet_lengths.values())):
+        '''
+            Create a new ring buffer (create = True) or attach
+            to an existing one by name
+        '''
+        if create:
+            size = _header.size + slots * (_slot_header.size + slot_size)
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            _header.pack_into(self._shm.buf, 0, 0, slots, slot_size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            _, slots, slot_size = _header.unpack_from(self._shm.buf, 0)
+
+        self.name = self._shm.name
+        self.slots = slots
+        self.slot_size = slot_size
+        self._stride = _slot_header.size + slot_size
+
+        # Reader position and statistics
+        self.cursor = self.sequence
+        self.dropped = 0
+        # Receive timestamp of the last packet read
+        self.timestamp = 0
+
+    @property
+    def sequence(self):
+        '''Sequence number of the next packet to be written'''
+        return _sequence.unpack_from(self._shm.buf, 0)[0]
+
+    def write(self, packet, timestamp = 0):
+        '''
+            Write a packet into the next slot (producer only), optionally
+            with the time it was received (monotonic_ns)
+        '''
+        size = len(packet)
+        if size > self.slot_size:
+            raise ValueError(f'Packet length {size} exceeds slot size {self.slot_size}')
+
+        buf = self._shm.buf
+        sequence = self.sequence
+        offset = _header.size + (sequence % self.slots) * self._stride
+
+        # Invalidate the slot while writing, then publish the sequence
+        buf[offset:offset + _sequence.size] = _sequence.pack(0)
+        buf[offset + _sequence.size:offset + _timestamp_offset] = _length.pack(size)
+        buf[offset + _timestamp_offset:offset + _slot_header.size] = _timestamp.pack(timestamp)
+        buf[offset + _slot_header.size:offset + _slot_header.size + size] = packet
+        buf[offset:offset + _sequence.size] = _sequence.pack(sequence + 1)
+        buf[0:_sequence.size] = _sequence.pack(sequence + 1)
+
+    def read(self, sequence):
+        '''
+            Read the packet with the given sequence number, returns
+            None if it has not been written yet or was overwritten
+        '''
+        buf = self._shm.buf
+        offset = _header.size + (sequence % self.slots) * self._stride
+        tag, size, timestamp = _slot_header.unpack_from(buf, offset)
+        if tag != sequence + 1:
+            return None
+        packet = bytes(buf[offset + _slot_header.size:offset + _slot_header.size + size])
+
+        # Ensure the slot was not overwritten while copying
+        if _sequence.unpack_from(buf, offset)[0] != tag:
+            return None
+        self.timestamp = timestamp
+        return packet
+
+    def read_latest(self):
+        '''Read the most recently written packet (or None)'''
+        sequence = self.sequence
+        while sequence > 0:
+            packet = self.read(sequence - 1)
+            if packet is not None:
+                self.cursor = sequence
+                return packet
+            # The producer lapped us while reading, try again
+            sequence = self.sequence
+        return None
+
+    def read_new(self):
+        '''Yield every packet written since the last read'''
+        head = self.sequence
+        # Skip any packets which have already been overwritten
+        if head - self.cursor > self.slots:
+            self.dropped += head - self.cursor - self.slots
+            self.cursor = head - self.slots
+        while self.cursor < head:
+            packet = self.read(self.cursor)
+            self.cursor += 1
+            if packet is None:
+                self.dropped += 1
+                continue
+            yield packet
+
+    def close(self):
+        '''Detach from the shared memory'''
+        self._shm.close()
+
+    def unlink(self):
+        '''Release the shared memory (creator only)'''
+        self._shm.unlink()
+
+class LatestPacketSlot():
+    '''
+        LatestPacketSlot - a single shared memory slot holding only the newest
+        raw data packet, protected by a seqlock. The writer makes the sequence
+        odd while copying so readers retry instead of seeing a torn packet,
+        and readers only decode a packet when they actually need it.
+    '''
+    # Attempts to read a consistent packet before giving up (ex. the writer
+    # died part way through a packet), yielding to other threads every 64
+    max_retries = 1024
+
+    def __init__(self, name = None, create = False, slot_size = max(DataPacket._packet_lengths.values())):
+        '''
+            Create a new slot (create = True) or attach
+            to an existing one by name
+        '''
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=_slot_header.size + slot_size)
+            _slot_header.pack_into(self._shm.buf, 0, 0, 0, 0)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+
+        self.name = self._shm.name
+        self.slot_size = self._shm.size - _slot_header.size
+
+        # Reader position and statistics
+        self.cursor = 0
+        self.coalesced = 0
+        # Receive timestamp of the last packet read
+        self.timestamp = 0
+
+    @property
+    def sequence(self):
+        '''Seqlock sequence (odd while a packet is being written)'''
+        return _sequence.unpack_from(self._shm.buf, 0)[0]
+
+    def write(self, packet, timestamp = 0):
+        '''
+            Replace the packet in the slot (producer only), optionally
+            with the time it was received (monotonic_ns)
+        '''
+        size = len(packet)
+        if size > self.slot_size:
+            raise ValueError(f'Packet length {size} exceeds slot size {self.slot_size}')
+
+        buf = self._shm.buf
+        sequence = self.sequence
+        buf[0:_sequence.size] = _sequence.pack(sequence + 1)
+        buf[_sequence.size:_timestamp_offset] = _length.pack(size)
+        buf[_timestamp_offset:_slot_header.size] = _timestamp.pack(timestamp)
+        buf[_slot_header.size:_slot_header.size + size] = packet
+        buf[0:_sequence.size] = _sequence.pack(sequence + 2)
+
+    def read_latest(self):
+        '''Read a consistent copy of the newest packet (or None)'''
+        buf = self._shm.buf
+        for attempt in range(self.max_retries):
+            sequence, size, timestamp = _slot_header.unpack_from(buf, 0)
+            if sequence == 0:
+                return None
+            # Retry while the writer is part way through a packet
+            if sequence % 2 == 0:
+                packet = bytes(buf[_slot_header.size:_slot_header.size + size])
+                if _sequence.unpack_from(buf, 0)[0] == sequence:
+                    self.cursor = sequence
+                    self.timestamp = timestamp
+                    return packet
+            # Release the GIL now and then so a spinning reader cannot starve the UI
+            if attempt % 64 == 63:
+                sleep(0)
+        return None
+
+    def read_new(self):
+        '''Yield the newest packet if it changed since the last read'''
+        sequence = self.sequence
+        if sequence == self.cursor:
+            return
+        previous = self.cursor
+        packet = self.read_latest()
+        if packet is not None:
+            # Count the packets replaced before we read them
+            self.coalesced += max(0, (self.cursor - previous) // 2 - 1)
+            yield packet
+
+    def close(self):
+        '''Detach from the shared memory'''
+        self._shm.close()
+
+    def unlink(self):
+        '''Release the shared memory (creator only)'''
+        self._shm.unlink()
@@ -0,0 +1,89 @@
+from time import perf_counter_ns, sleep
+
+def sleep_until(deadline, spin = 1000000):
+    '''
+        Sleep until shortly before a perf_counter_ns deadline and then
+        spin for the remainder (spin in nanoseconds)
+    '''
+    remaining = deadline - perf_counter_ns() - spin
+    if remaining > 0:
+        sleep(remaining / 1e9)
+    while perf_counter_ns() < deadline:
+        pass
+
+class PeriodicScheduler():
+    '''
+        PeriodicScheduler - wait for fixed-period deadlines. Deadlines are
+        absolute (start + n * period) so neither lateness nor rounding drifts
+        the schedule over long runs, and the lateness of each wakeup is
+        tracked as jitter statistics. The scheduler sleeps until shortly
+        before each deadline and then spins for the remainder.
+    '''
+    def __init__(self, period, rate = 1.0, spin = 0.001):
+        '''
+            Periodic Scheduler
+            (period and spin in seconds, rate = speed multiplier)
+        '''
+        if period <= 0:
+            raise ValueError('Period must be greater than zero')
+        self.period = period
+        self.spin_ns = int(spin * 1e9)
+        self._rate = rate
+        self.rate = rate
+        self.reset()
+
+    @property
+    def rate(self):
+        '''Speed multiplier applied to the period (ex. 2.0 = twice as fast)'''
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate):
+        if rate <= 0:
+            raise ValueError('Rate must be greater than zero')
+        self._rate = rate
+        self._period_ns = self.period * 1e9 / rate
+        # Continue the new schedule from the last deadline
+        if hasattr(self, '_start'):
+            self._start = self._deadline - self._period_ns
+            self._count = 1
+            self._deadline = self._start + round(self._period_ns)
+
+    def reset(self):
+        '''Restart the schedule from now and clear the statistics'''
+        self._start = perf_counter_ns()
+        self._count = 1
+        self._deadline = self._start + round(self._period_ns)
+        self.ticks = 0
+        self.overruns = 0
+        self.jitter_max = 0
+        self._jitter_total = 0
+
+    def wait(self):
+        '''Sleep (then spin) until the next deadline'''
+        deadline = self._deadline
+        sleep_until(deadline, self.spin_ns)
+
+        # Record how late we woke up
+        jitter = perf_counter_ns() - deadline
+        self.ticks += 1
+        self._jitter_total += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+
+        # If we missed whole periods, skip them rather than bursting to catch up
+        self._count += 1
+        if jitter > self._period_ns:
+            missed = int(jitter // self._period_ns)
+            self.overruns += missed
+            self._count += missed
+        self._deadline = self._start + round(self._count * self._period_ns)
+
+    @property
+    def stats(self):
+        '''Return the jitter statistics (in milliseconds)'''
+        return {
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'jitter_avg_ms': round(self._jitter_total / self.ticks / 1e6, 3) if self.ticks else 0,
+            'jitter_max_ms': round(self.jitter_max / 1e6, 3),
+        }
@@ -0,0 +1,162 @@
+from concurrent.futures import ProcessPoolExecutor
+from json import dump, load
+from os import cpu_count, makedirs, path, replace, stat, walk
+
+from util.analysis import SessionAnalysis
+from util.packet_cache import file_hash
+
+# File extensions of the recordings written by tools.py record (so config
+# and cache .json files are not mistaken for recordings)
+_extensions = ('.fzr', '.json.gz')
+
+def summarize_recording(file, known_hashes = ()):
+    '''
+        Hash and summarise a single recording, returning (hash, summary).
+        The summary is None if the hash is already known (and it was
+        not analysed) or contains an error if it could not be analysed
+    '''
+    digest = file_hash(file)
+    if digest in known_hashes:
+        return digest, None
+    try:
+        return digest, SessionAnalysis.from_file(file).summary()
+    except Exception as e:
+        return digest, {'error': str(e)}
+
+class SeasonAnalysis():
+    '''
+        SeasonAnalysis - summarise every recording in a directory across
+        all cores, caching each summary by the recording's content hash so
+        only new or changed recordings are analysed again. Summaries are
+        then combined into per-track and per-car aggregates.
+    '''
+    _cache_format = 1
+
+    def __init__(self, directory, cache_dir = None, processes = None):
+        self.directory = directory
+        self.cache_dir = cache_dir
+        self.processes = processes or cpu_count()
+
+        # Ensure the directory passed is valid
+        if not path.isdir(self.directory):
+            raise ValueError(f'Invalid directory: {self.directory}')
+
+        # Counters from the last run
+        self.analysed = 0
+        self.cached = 0
+
+    @property
+    def recordings(self):
+        '''Every recording in the directory (and its sub-directories)'''
+        files = []
+        for root, directories, names in walk(self.directory):
+            # Never look inside the cache
+            if self.cache_dir is not None:
+                cache_dir = path.abspath(self.cache_dir)
+                directories[:] = [name for name in directories if path.abspath(path.join(root, name)) != cache_dir]
+            files += [path.join(root, name) for name in names if name.endswith(_extensions)]
+        return sorted(files)
+
+    def summaries(self):
+        '''
+            Return the summary of every recording (keyed by file path),
+            analysing only the recordings not found in the cache
+        '''
+        cache = self._load_cache()
+        files = {}
+        pending = []
+        for file in self.recordings:
+            info = stat(file)
+            entry = cache['files'].get(file)
+            # Unchanged files (same size and modification time) are not even hashed
+            if entry is not None and entry['mtime'] == info.st_mtime_ns and entry['size'] == info.st_size \
+                    and entry['hash'] in cache['summaries']:
+                files[file] = entry
+            else:
+                files[file] = {'mtime': info.st_mtime_ns, 'size': info.st_size, 'hash': None}
+                pending.append(file)
+
+        # Hash the new or changed files and analyse the ones with new contents
+        self.analysed = 0
+        self.cached = len(files) - len(pending)
+        if pending:
+            known_hashes = set(cache['summaries'])
+            with ProcessPoolExecutor(max_workers=min(self.processes, len(pending))) as executor:
+                results = executor.map(summarize_recording, pending, [known_hashes] * len(pending))
+                for file, (digest, summary) in zip(pending, results):
+                    files[file]['hash'] = digest
+                    if summary is None:
+                        self.cached += 1
+                        continue
+                    self.analysed += 1
+                    cache['summaries'][digest] = summary
+
+        # Only keep the summaries of recordings which still exist
+        cache['files'] = files
+        hashes = set(entry['hash'] for entry in files.values())
+        cache['summaries'] = {digest: summary for digest, summary in cache['summaries'].items() if digest in hashes}
+        self._save_cache(cache)
+
+        return {file: cache['summaries'][entry['hash']] for file, entry in files.items()}
+
+    def aggregate(self, summaries = None):
+        '''
+            Combine the session summaries into per-track and per-car
+            aggregates, keyed by (track, car_ordinal_id)
+        '''
+        if summaries is None:
+            summaries = self.summaries()
+
+        aggregates = {}
+        for file, summary in summaries.items():
+            # Skip recordings which could not be analysed or have no laps
+            if 'error' in summary or summary['laps'] == 0:
+                continue
+            key = (summary['track'], summary['car_ordinal_id'])
+            if key not in aggregates:
+                aggregates[key] = {
+                    'sessions': 0, 'laps': 0, 'best_lap': None, 'best_lap_file': None,
+                    'car_class_id': summary['car_class_id'], 'car_performance_index': summary['car_performance_index'],
+                    '_total_time': 0, '_fuel_total': 0, '_fuel_laps': 0,
+                }
+            aggregate = aggregates[key]
+            aggregate['sessions'] += 1
+            aggregate['laps'] += summary['laps']
+            aggregate['_total_time'] += summary['average_lap_time'] * summary['laps']
+            if summary['fuel_per_lap'] is not None:
+                aggregate['_fuel_total'] += summary['fuel_per_lap'] * summary['laps']
+                aggregate['_fuel_laps'] += summary['laps']
+            if aggregate['best_lap'] is None or summary['best_lap'] < aggregate['best_lap']:
+                aggregate['best_lap'] = summary['best_lap']
+                aggregate['best_lap_file'] = file
+
+        # Convert the running totals into averages
+        for aggregate in aggregates.values():
+            aggregate['average_lap_time'] = round(aggregate.pop('_total_time') / aggregate['laps'], 3)
+            fuel_total, fuel_laps = aggregate.pop('_fuel_total'), aggregate.pop('_fuel_laps')
+            aggregate['fuel_per_lap'] = round(fuel_total / fuel_laps, 4) if fuel_laps else None
+        return aggregates
+
+    def _load_cache(self):
+        '''Load the cached summaries (Private)'''
+        cache = {'format': self._cache_format, 'files': {}, 'summaries': {}}
+        if self.cache_dir is None:
+            return cache
+        cache_file = path.join(self.cache_dir, 'season.json')
+        if path.isfile(cache_file):
+            with open(cache_file, 'r') as f:
+                saved = load(f)
+            # Ignore caches written by an older version
+            if saved.get('format') == self._cache_format:
+                cache = saved
+        return cache
+
+    def _save_cache(self, cache):
+        '''Save the summaries (atomically in case we are interrupted) (Private)'''
+        if self.cache_dir is None:
+            return
+        makedirs(self.cache_dir, exist_ok=True)
+        cache_file = path.join(self.cache_dir, 'season.json')
+        with open(cache_file + '.tmp', 'w') as f:
+            dump(cache, f)
+        replace(cache_file + '.tmp', cache_file)
@@ -1,18 +1,135 @@
 from colour import Color
-from functools import reduce
 from math import floor, modf
 
 RGB_SCALER = lambda x: (round(x[0] * 255), round(x[1] * 255), round(x[2] * 255))
 
+class TemperatureColorMap():
+    '''
+        Precomputed temperature to RGB (0-255) lookup table, indexed directly
+        by the integer temperature and clamped to the gradient's range
+    '''
+    def __init__(self, low = 100, high = 350, colors = ['#00d0ff', '#dd0000']):
+        if high <= low:
+            raise ValueError(f'Invalid temperature range: {low} - {high}')
+        if len(colors) < 2 or len(colors) - 1 > high - low:
+            raise ValueError(f'Invalid number of colors for a gradient: {len(colors)}')
+        self.low = low
+        self.high = high
+
+        # Blend evenly between each color stop, one entry per degree
+        steps = high - low
+        stops = len(colors) - 1
+        table = []
+        for i in range(stops):
+            count = (i + 1) * steps // stops - i * steps // stops
+            # Each segment ends where the next one starts, except the last
+            if i == stops - 1:
+                segment = Color(colors[i]).range_to(colors[i + 1], count)
+            else:
+                segment = list(Color(colors[i]).range_to(colors[i + 1], count + 1))[:count]
+            table.extend(segment)
+        self.table = tuple(RGB_SCALER(c.rgb) for c in table)
+        self._last = len(self.table) - 1
+
+    def __getitem__(self, temperature):
+        '''Return the color for a temperature'''
+        index = int(temperature) - self.low
+        if index < 0:
+            return self.table[0]
+        if index > self._last:
+            return self.table[self._last]
+        return self.table[index]
+
+    @classmethod
+    def from_config(cls, config):
+        '''
+            Build the color map for each car class from the configuration
+            ex. {"default": {"low": 100, "high": 350, "colors": [...]}, "5": {...}}
+        '''
+        return {
+            car_class: cls(**values)
+            for car_class, values in config.items()
+        }
+
+class LapStints():
+    '''
+        Lap stint tracker - keeps the distance, fuel and time of each completed
+        lap along with running totals so every update and query is O(1)
+    '''
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        '''Remove all lap information'''
+        # Per-lap values (keyed by lap number)
+        self.dist = {}
+        self.fuel = {}
+        self.time = {}
+        # Running totals
+        self.total_dist = 0
+        self.total_fuel_used = 0
+        self.total_time = 0
+        self._fuel_laps = 0
+
+    def complete_lap(self, lap_num, dist_traveled, fuel, lap_time):
+        '''Record a completed lap'''
+        # Replace the lap if it was already recorded
+        if lap_num in self.dist:
+            self.total_dist -= self.dist[lap_num]
+            self.total_time -= self.time[lap_num]
+            if lap_num - 1 in self.fuel:
+                self.total_fuel_used -= self.fuel[lap_num - 1] - self.fuel[lap_num]
+                self._fuel_laps -= 1
+
+        self.dist[lap_num] = dist_traveled - self.total_dist
+        self.fuel[lap_num] = fuel
+        self.time[lap_num] = lap_time
+        self.total_dist += self.dist[lap_num]
+        self.total_time += lap_time
+
+        # Fuel used can only be calculated if we saw the previous lap finish
+        if lap_num - 1 in self.fuel:
+            self.total_fuel_used += self.fuel[lap_num - 1] - fuel
+            self._fuel_laps += 1
+
+    @property
+    def fuel_per_lap(self):
+        '''Average fuel used per lap (0.0 - 1.0 of a full tank)'''
+        if self._fuel_laps == 0:
+            return None
+        return self.total_fuel_used / self._fuel_laps
+
+    @property
+    def average_lap_time(self):
+        '''Average lap time in seconds'''
+        if len(self.time) == 0:
+            return None
+        return self.total_time / len(self.time)
+
+    def fuel_needed(self, laps):
+        '''Projected fuel needed to complete a number of laps'''
+        fuel_per_lap = self.fuel_per_lap
+        return None if fuel_per_lap is None else fuel_per_lap * laps
+
+    def time_needed(self, laps):
+        '''Projected time (in seconds) needed to complete a number of laps'''
+        average_lap_time = self.average_lap_time
+        return None if average_lap_time is None else average_lap_time * laps
+
 class Telemetry():
     '''Telemetry calculation'''
-    _lap_stats = {'fuel': {}, 'dist': {}}
-
-    def __init__(self, data = {}):
+    def __init__(self, data = {}, color_maps = {}, lap_delta = None, track_timer = None):
         self.data = data
-        # Cache tire temperature colors in RGB 0-255 scale
-        color_range = [c.rgb for c in Color('#00d0ff').range_to('#dd0000', 250)]
-        self._tire_temperature_colors = list(map(RGB_SCALER, color_range))
+        # Lap stint information is tracked per instance (one per rig)
+        self.stints = LapStints()
+        # Optional delta to the best lap (see util.delta.LapDelta)
+        self.lap_delta = lap_delta
+        # Optional live sector and corner timing (see util.track_map.TrackTimer)
+        self.track_timer = track_timer
+        # Tire temperature color tables (optionally per car class)
+        self.color_maps = TemperatureColorMap.from_config(color_maps)
+        if 'default' not in self.color_maps:
+            self.color_maps['default'] = TemperatureColorMap()
 
     def seconds_to_lap_time(self, value):
         '''Convert seconds to lap time format (MM:SS:MS)'''
@@ -33,16 +150,20 @@ class Telemetry():
         if 'lap_time_current' in self.data and self.get_value('lap_time_current') > data['lap_time_current']:
             # Ensure the game was not just paused
             if data['lap_time_current'] != 0:
-                dist_start = reduce(lambda a, b: a + b, self._lap_stats['dist'].values(), 0)
-                self._lap_stats['dist'][lap_num] = self.get_value('dist_traveled') - dist_start
-                self._lap_stats['fuel'][lap_num] = self.get_value('fuel')
+                self.stints.complete_lap(
+                    lap_num, self.get_value('dist_traveled'),
+                    self.get_value('fuel'), data['lap_time_last']
+                )
 
+        if self.lap_delta is not None:
+            self.lap_delta.load(data)
+        if self.track_timer is not None:
+            self.track_timer.load(data)
         self.data = data
 
     def clear_stints(self):
         '''Remove lap stint information such as fuel and distance'''
-        self._lap_stats['fuel'].clear()
-        self._lap_stats['dist'].clear()
+        self.stints.clear()
 
     def get_value(self, key):
         '''Get a data packet value'''
@@ -57,18 +178,25 @@ class Telemetry():
 
     @property
     def time_gain(self):
-        '''Calculate the total lap time gain based on previous lap pace'''
+        '''
+            Calculate the time gain against the best lap at the same distance
+            if available, otherwise estimate it based on the previous lap pace
+        '''
+        if self.lap_delta is not None and self.lap_delta.delta is not None:
+            # Avoid showing -0.0 when exactly on pace
+            return self._format_gain(round(self.lap_delta.delta, 1) or 0.0)
+
         lap_num = self.get_value('lap_num')
         default_value = {'value': '+0.0', 'color': '#ffff00'}
 
         # Check if the first lap, ensure lap data is present
         if lap_num == 0:
             return default_value
-        if lap_num - 1 not in self._lap_stats['dist'].keys():
+        if lap_num - 1 not in self.stints.dist:
             return default_value
 
         # Get the previous lap pace
-        last_lap_dist = self._lap_stats['dist'][lap_num - 1]
+        last_lap_dist = self.stints.dist[lap_num - 1]
         last_lap_dist_per_sec = last_lap_dist / self.get_value('lap_time_last')
         # Check if the dashboard was started after the race was started
         if last_lap_dist_per_sec == 0:
@@ -76,15 +204,26 @@ class Telemetry():
         last_lap_time_estimate_secs = last_lap_dist / last_lap_dist_per_sec
 
         # Get our current lap pace
-        current_lap_dist = self.get_value('dist_traveled') - reduce(lambda a, b: a + b, self._lap_stats['dist'].values(), 0)
+        current_lap_dist = self.get_value('dist_traveled') - self.stints.total_dist
         current_lap_dist_per_sec = current_lap_dist / self.get_value('lap_time_current')
         current_lap_time_estimate_secs = last_lap_dist / current_lap_dist_per_sec
 
         # Return the delta between our current pace and last lap
         stint_delta = round(current_lap_time_estimate_secs - last_lap_time_estimate_secs, 1)
+        return self._format_gain(stint_delta)
+
+    @property
+    def sector_gain(self):
+        '''Time gained or lost in the last completed sector against the best sector (or None)'''
+        if self.track_timer is None or self.track_timer.sector_delta is None:
+            return None
+        return self._format_gain(round(self.track_timer.sector_delta, 2) or 0.0)
+
+    def _format_gain(self, delta):
+        '''Format a time gain (in seconds) and its color (Private)'''
         return {
-            'value': f'+{stint_delta}' if stint_delta > 0 else str(stint_delta),
-            'color': '#dd0000' if stint_delta > 0 else '#51c651'
+            'value': f'+{delta}' if delta > 0 else str(delta),
+            'color': '#dd0000' if delta > 0 else '#51c651'
         }
 
     @property
@@ -100,13 +239,31 @@ class Telemetry():
 
         # Ensure the last lap's information is available
         last_lap_num = self.get_value('lap_num') - 1
-        if last_lap_num not in self._lap_stats['fuel'].keys():
+        if last_lap_num not in self.stints.fuel:
             return '0.0%'
 
         # Calculate the lap delta
-        fuel_delta = self._lap_stats['fuel'][last_lap_num] - self.get_value('fuel')
+        fuel_delta = self.stints.fuel[last_lap_num] - self.get_value('fuel')
         return f'{round(fuel_delta * 100, 1)}%'
 
+    def fuel_projection(self, race_laps):
+        '''
+            Project the fuel and time needed for the remaining race laps
+            based on the average of the completed laps (None until a lap
+            number has been received)
+        '''
+        lap_num = self.get_value('lap_num')
+        if lap_num is None:
+            return None
+        remaining_laps = max(0, race_laps - lap_num)
+        fuel_needed = self.stints.fuel_needed(remaining_laps)
+        return {
+            'laps': remaining_laps,
+            'fuel_needed': fuel_needed,
+            'fuel_margin': None if fuel_needed is None else self.get_value('fuel') - fuel_needed,
+            'time_needed': self.stints.time_needed(remaining_laps),
+        }
+
     @property
     def fuel_level(self):
         '''Return the fuel level as a percentage'''
@@ -140,33 +297,19 @@ class Telemetry():
 
     @property
     def tire_temperature(self):
-        '''Calculate the tire temperature and a matching color'''
-        temp = {
-            'FL': {
-                'value': self.get_value('tire_temp_FL')
-            },
-            'FR': {
-                'value': self.get_value('tire_temp_FR')
-            },
-            'RL': {
-                'value': self.get_value('tire_temp_RL')
-            },
-            'RR': {
-                'value': self.get_value('tire_temp_RR')
-            }
-        }
-
-        # Show green, red, or a blended color between the two depending on the temp
-        for tire in temp.values():
-            if tire['value'] < 100:
-                tire['color'] = RGB_SCALER(Color('#00d0ff').rgb)
-            elif tire['value'] >= 350:
-                tire['color'] = RGB_SCALER(Color('#dd0000').rgb)
-            else:
-                value = floor(tire['value'] - 100)
-                tire['color'] = self._tire_temperature_colors[value]
-
-        return temp
+        '''
+            Calculate the tire temperature and a matching color
+            (FL value, FL color, FR value, FR color, RL ..., RR ...)
+        '''
+        color_map = self.color_maps.get(str(self.get_value('car_class_id')), self.color_maps['default'])
+        fl = self.data['tire_temp_FL']
+        fr = self.data['tire_temp_FR']
+        rl = self.data['tire_temp_RL']
+        rr = self.data['tire_temp_RR']
+        return (
+            fl, color_map[fl], fr, color_map[fr],
+            rl, color_map[rl], rr, color_map[rr]
+        )
 
     @property
     def wheel_slip(self):
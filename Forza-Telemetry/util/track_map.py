@@ -0,0 +1,394 @@
+from bisect import bisect_right
+from glob import glob
+from os import makedirs, path, replace
+
+import numpy as np
+
+from util.analysis import track_key
+
+class TrackMap():
+    '''
+        TrackMap - a track's centreline (built from recorded laps) with a
+        grid index over its points, so a position (position_x/z) can be
+        mapped to how far around the lap it is in well under a millisecond.
+        Corners are found from the curvature of the centreline.
+    '''
+    # Size of each grid cell (in meters), wider than a track so the
+    # nearest centreline point is always in a neighboring cell
+    cell_size = 25
+
+    def __init__(self, x, z, lap_distance, track = None):
+        self.x = np.asarray(x, dtype=np.float64)
+        self.z = np.asarray(z, dtype=np.float64)
+        self.lap_distance = float(lap_distance)
+        self.track = track
+        self.spacing = self.lap_distance / len(self.x)
+
+        # Plain lists are faster than arrays for per-packet lookups
+        self._x = self.x.tolist()
+        self._z = self.z.tolist()
+
+        # Index the points by grid cell
+        self._grid = {}
+        cells = zip((self.x // self.cell_size).astype(int).tolist(), (self.z // self.cell_size).astype(int).tolist())
+        for index, cell in enumerate(cells):
+            self._grid.setdefault(cell, []).append(index)
+
+        self.corners = self._find_corners()
+
+    def __len__(self):
+        return len(self._x)
+
+    @classmethod
+    def build(cls, laps, spacing = 2, track = None):
+        '''
+            Build a track map from one or more laps of (x, z, distance into
+            the lap) arrays. Each lap is resampled every spacing meters and
+            the laps are averaged into a single centreline
+        '''
+        if not laps:
+            raise ValueError('At least one lap is required to build a track map')
+        lap_distance = float(np.median([distance[-1] - distance[0] for _, _, distance in laps]))
+        count = max(10, round(lap_distance / spacing))
+        fractions = np.arange(count) / count
+
+        x = np.zeros(count)
+        z = np.zeros(count)
+        for lap_x, lap_z, distance in laps:
+            # Resample by the fraction of the lap covered
+            covered = np.maximum.accumulate(distance - distance[0]) / (distance[-1] - distance[0])
+            x += np.interp(fractions, covered, lap_x)
+            z += np.interp(fractions, covered, lap_z)
+        return cls(x / len(laps), z / len(laps), lap_distance, track)
+
+    @classmethod
+    def from_analysis(cls, analysis, cache_dir = None):
+        '''
+            Return the track map for the track of a SessionAnalysis, loading
+            it from the cache if it was built before, otherwise building it
+            from the session's complete laps (and caching it)
+        '''
+        track = analysis.track
+        if track is None:
+            raise ValueError('No complete laps found to build a track map from')
+        cache_file = None if cache_dir is None else path.join(cache_dir, f'{track}.npz')
+        if cache_file is not None and path.isfile(cache_file):
+            return cls.load(cache_file)
+
+        data = analysis.data
+        laps = []
+        for lap in analysis.complete_laps:
+            rows = data[lap['start']:lap['end']]
+            laps.append((rows['position_x'], rows['position_z'], rows['dist_traveled'].astype(np.float64)))
+        track_map = cls.build(laps, track=track)
+
+        if cache_file is not None:
+            makedirs(cache_dir, exist_ok=True)
+            track_map.save(cache_file)
+        return track_map
+
+    @classmethod
+    def find(cls, cache_dir, x, z):
+        '''Load the cached track map whose start/finish line is at a position (or None)'''
+        files = glob(path.join(cache_dir, f'{track_key(x, z)}_*.npz'))
+        return cls.load(files[0]) if files else None
+
+    @classmethod
+    def load(cls, file):
+        '''Load a track map saved with save()'''
+        with np.load(file, allow_pickle=False) as values:
+            track = path.basename(file)[:-len('.npz')]
+            return cls(values['x'], values['z'], values['lap_distance'], track)
+
+    def save(self, file):
+        '''Save the track map (atomically in case we are interrupted)'''
+        with open(file + '.tmp', 'wb') as f:
+            np.savez(f, x=self.x, z=self.z, lap_distance=self.lap_distance)
+        replace(file + '.tmp', file)
+
+    def locate(self, x, z, hint = None):
+        '''
+            Map a position to the fraction of the lap covered (0.0 - 1.0),
+            returning (fraction, index of the nearest centreline point) or
+            (None, hint) if the position is away from the track. Passing the
+            previous index as a hint prefers nearby points where the track
+            crosses itself
+        '''
+        cell_x, cell_z = int(x // self.cell_size), int(z // self.cell_size)
+        points = self._x, self._z
+        count = len(self._x)
+        window = count // 20
+
+        best = None
+        best_score = None
+        for dx in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                for index in self._grid.get((cell_x + dx, cell_z + dz), ()):
+                    score = (points[0][index] - x) ** 2 + (points[1][index] - z) ** 2
+                    # Penalise points far (around the lap) from the previous position
+                    if hint is not None and min(abs(index - hint), count - abs(index - hint)) > window:
+                        score += self.cell_size ** 2 * 4
+                    if best_score is None or score < best_score:
+                        best, best_score = index, score
+        if best is None:
+            return None, hint
+
+        # Project onto the centreline towards the next point
+        following = (best + 1) % count
+        vx, vz = points[0][following] - points[0][best], points[1][following] - points[1][best]
+        length = vx * vx + vz * vz
+        offset = 0 if length == 0 else ((x - points[0][best]) * vx + (z - points[1][best]) * vz) / length
+        return ((best + max(-1, min(1, offset))) / count) % 1.0, best
+
+    def locate_many(self, x, z):
+        '''Map many positions (ex. a recorded lap) to fractions of the lap (NaN if away from the track)'''
+        fractions = np.full(len(x), np.nan)
+        hint = None
+        for i, (px, pz) in enumerate(zip(np.asarray(x).tolist(), np.asarray(z).tolist())):
+            fraction, hint = self.locate(px, pz, hint)
+            if fraction is not None:
+                fractions[i] = fraction
+        return fractions
+
+    def sectors(self, count = 3):
+        '''Fractions of the lap at which each sector after the first starts'''
+        return [k / count for k in range(1, count)]
+
+    def compare_laps(self, analysis):
+        '''
+            Time each corner of every complete lap of a SessionAnalysis,
+            along with the minimum speed in each corner. Sector times are
+            those of the analysis so both always agree
+        '''
+        data = analysis.data
+        laps = []
+        for lap in analysis.complete_laps:
+            rows = data[lap['start']:lap['end']]
+            fractions = self.locate_many(rows['position_x'], rows['position_z'])
+            # Positions just short of the line at the start of the lap belong to this lap
+            fractions[(np.arange(len(fractions)) < len(fractions) // 10) & (fractions > 0.5)] = 0
+            valid = ~np.isnan(fractions)
+            # Fractions only increase around a lap (ignore small jitter back)
+            covered = np.maximum.accumulate(np.where(valid, fractions, 0))
+            lap_time = rows['lap_time_current'].astype(np.float64)
+
+            corners = []
+            for corner in self.corners:
+                # Corners through the start/finish line are not timed
+                if corner['exit'] < corner['entry']:
+                    corners.append({'time': None, 'min_speed': None})
+                    continue
+                entry, exit = np.interp([corner['entry'], corner['exit']], covered, lap_time)
+                inside = (covered >= corner['entry']) & (covered <= corner['exit'])
+                min_speed = float(rows['speed'][inside].min()) if inside.any() else None
+                corners.append({'time': round(float(exit - entry), 3), 'min_speed': min_speed})
+            laps.append({
+                'lap': lap['lap'],
+                'time': lap['time'],
+                'sectors': lap['sectors'],
+                'corners': corners,
+            })
+        return laps
+
+    def _find_corners(self, window = 20, threshold = 0.006, minimum = 15):
+        '''
+            Find the corners as the stretches of the centreline turning more
+            than threshold radians per meter (measured over window meters),
+            ignoring stretches shorter than minimum meters (Private)
+        '''
+        count = len(self.x)
+        steps = max(1, round(window / self.spacing / 2))
+        # Heading of each point (0 = forward (z), increasing to the right (x))
+        heading = np.arctan2(np.roll(self.x, -1) - self.x, np.roll(self.z, -1) - self.z)
+        turn = np.angle(np.exp(1j * (np.roll(heading, -steps) - np.roll(heading, steps))))
+        curvature = turn / (2 * steps * self.spacing)
+        turning = np.abs(curvature) > threshold
+        if turning.all() or not turning.any():
+            return []
+
+        # Walk the lap from a straight so corners crossing the line are kept whole
+        start = int(np.argmin(turning))
+        corners = []
+        entry = None
+        for offset in range(count + 1):
+            index = (start + offset) % count
+            if turning[index] and entry is None:
+                entry = index
+            elif not turning[index] and entry is not None:
+                length = (index - entry) % count
+                if length * self.spacing >= minimum:
+                    span = [(entry + i) % count for i in range(length)]
+                    apex = span[int(np.argmax(np.abs(curvature[span])))]
+                    corners.append({
+                        'entry': entry / count,
+                        'apex': apex / count,
+                        'exit': index / count,
+                        'direction': 'right' if curvature[apex] > 0 else 'left',
+                    })
+                entry = None
+        return sorted(corners, key=lambda corner: corner['entry'])
+
+class TrackTimer():
+    '''
+        TrackTimer - live sector and corner timing. Each packet is mapped
+        onto the track map and the lap time is recorded (interpolated
+        between packets) as the car passes each sector boundary and corner
+        entry/exit, so the current lap can be compared to the best one
+    '''
+    def __init__(self, cache_dir = None, track_map = None, sectors = 3):
+        '''
+            Track Timer
+            (cache_dir = directory of cached track maps, found by the
+            start/finish line, or track_map = a TrackMap to use)
+        '''
+        self.cache_dir = cache_dir
+        self.sector_count = sectors
+        self.track_map = None
+        self.best_sectors = None
+        self.best_corners = None
+        self.last_sectors = None
+        self.last_corners = None
+        self._lap_num = None
+        self._last_time = None
+        self._from_line = False
+        self._line_key = None
+        self._boundaries = []
+        self._events = []
+        self._start_lap()
+        if track_map is not None:
+            self._set_track_map(track_map)
+
+    def load(self, data):
+        '''Load a new data packet'''
+        lap_time = data.get('lap_time_current')
+        if 'position_x' not in data or not data.get('active', 1) or not lap_time:
+            return
+
+        # Detect if we just started a new lap (as in LapDelta.load)
+        lap_num = data.get('lap_num')
+        if self._lap_num is None or lap_num != self._lap_num:
+            if self._lap_num is not None and lap_num == self._lap_num + 1 and self._from_line:
+                self._complete_lap(data)
+            # Laps joined part way (ex. a rewind over the line) are not timed
+            self._begin_lap(data, lap_time < 1)
+        elif lap_time < self._last_time and lap_time < 1:
+            # The lap timer started within the lap (ex. a rolling start)
+            self._begin_lap(data, True)
+        self._last_time = lap_time
+        if self.track_map is None:
+            return
+
+        fraction, self._index = self.track_map.locate(data['position_x'], data['position_z'], self._index)
+        if fraction is None:
+            return
+        previous, self._fraction = self._fraction, fraction
+        previous_time, self._time = self._time, lap_time
+        if previous is None:
+            # Only time the events ahead of the first position
+            self._next_event = bisect_right(self._events, fraction)
+            return
+        if not 0 <= fraction - previous < 0.05:
+            # Jumped (ex. a rewind), continue from the new position
+            self._next_event = bisect_right(self._events, fraction)
+            return
+
+        # Record the time each event was passed, interpolated between the packets
+        while self._next_event < len(self._events) and self._events[self._next_event] <= fraction:
+            event = self._events[self._next_event]
+            progress = 0 if fraction == previous else (event - previous) / (fraction - previous)
+            self._times[event] = previous_time + progress * (lap_time - previous_time)
+            self._next_event += 1
+
+    @property
+    def current_sector(self):
+        '''Index of the sector the car is in (or None)'''
+        if self._fraction is None:
+            return None
+        return bisect_right(self._boundaries, self._fraction)
+
+    @property
+    def sector_times(self):
+        '''Times of the sectors completed on the current lap'''
+        return self._sector_times(self._times)
+
+    @property
+    def sector_delta(self):
+        '''Time gained or lost in the last completed sector against the best (or None)'''
+        times = self.sector_times
+        if not times or self.best_sectors is None:
+            return None
+        return times[-1] - self.best_sectors[len(times) - 1]
+
+    def _set_track_map(self, track_map):
+        '''Use a track map, resetting the lap (Private)'''
+        self.track_map = track_map
+        self._boundaries = track_map.sectors(self.sector_count)
+        self._events = sorted(set(
+            self._boundaries +
+            [corner['entry'] for corner in track_map.corners] +
+            [corner['exit'] for corner in track_map.corners]
+        ))
+        self._start_lap()
+
+    def _begin_lap(self, data, from_line):
+        '''
+            Start timing a new lap, finding the track map whenever the
+            start/finish line changes (ex. a different track) (Private)
+        '''
+        self._lap_num = data.get('lap_num')
+        self._from_line = from_line
+        line_key = track_key(data['position_x'], data['position_z'])
+        if from_line and self.cache_dir is not None and line_key != self._line_key:
+            self._line_key = line_key
+            # Times from another track can not be compared
+            self.best_sectors = self.best_corners = None
+            self.last_sectors = self.last_corners = None
+            track_map = TrackMap.find(self.cache_dir, data['position_x'], data['position_z'])
+            if track_map is None:
+                self.track_map = None
+            else:
+                self._set_track_map(track_map)
+        self._start_lap()
+
+    def _start_lap(self):
+        '''Reset the timing for a new lap (Private)'''
+        self._index = None
+        self._fraction = None
+        self._time = None
+        self._next_event = 0
+        self._times = {}
+
+    def _complete_lap(self, data):
+        '''Finish the sector and corner times of a lap (Private)'''
+        if self.track_map is None:
+            return
+
+        sectors = self._sector_times(self._times)
+        if len(sectors) == self.sector_count - 1:
+            sectors.append(data['lap_time_last'] - sum(sectors))
+            # Corners through the start/finish line are not timed
+            corners = [
+                self._times[corner['exit']] - self._times[corner['entry']]
+                if corner['entry'] < corner['exit'] and corner['entry'] in self._times and corner['exit'] in self._times else None
+                for corner in self.track_map.corners
+            ]
+            self.last_sectors, self.last_corners = sectors, corners
+
+            # Keep the best time of each sector and corner
+            if self.best_sectors is None:
+                self.best_sectors, self.best_corners = list(sectors), list(corners)
+            else:
+                self.best_sectors = [min(a, b) for a, b in zip(self.best_sectors, sectors)]
+                self.best_corners = [
+                    b if a is None else a if b is None else min(a, b)
+                    for a, b in zip(self.best_corners, corners)
+                ]
+
+    def _sector_times(self, times):
+        '''Convert the boundary times into sector times (Private)'''
+        splits = []
+        for boundary in self._boundaries:
+            if boundary not in times:
+                break
+            splits.append(times[boundary])
+        return np.diff(splits, prepend=0).tolist() if splits else []
@@ -204,3 +204,58 @@ class UIElements():
         frame.position_value.SetForegroundColour(wx.Colour(255, 255, 0))
         frame.position_value.SetFont(wx.Font(25, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL, 0, ""))
         frame.column_c.Add(frame.position_value, 0, wx.EXPAND, 5)
+
+    def draw_latency_overlay(self, frame, sizer):
+        '''Draw the (hidden by default) latency overlay along the bottom'''
+        frame.latency_value = wx.StaticText(frame.main_panel, wx.ID_ANY, "-", style=wx.ST_NO_AUTORESIZE)
+        frame.latency_value.SetForegroundColour(wx.Colour(160, 160, 160))
+        frame.latency_value.SetFont(wx.Font(10, wx.FONTFAMILY_TELETYPE, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL, 0, ""))
+        sizer.Add(frame.latency_value, 0, wx.EXPAND | wx.ALL, 5)
+        frame.latency_value.Hide()
+
+class WidgetRenderer():
+    '''
+        Cache the last rendered label and colour for each widget so only
+        widgets whose values changed are touched, applying the changes for
+        a frame together between Freeze/Thaw
+    '''
+    def __init__(self, frame):
+        self.frame = frame
+        self._labels = {}
+        self._colours = {}
+        self._pending = []
+        # Widgets updated in the last rendered frame, and in total
+        self.widgets_updated = 0
+        self.total_updated = 0
+        self.total_skipped = 0
+
+    def set_label(self, widget, label):
+        '''Queue a label change if it differs from the rendered label'''
+        if self._labels.get(widget) == label:
+            self.total_skipped += 1
+            return
+        self._labels[widget] = label
+        self._pending.append((widget.SetLabel, label))
+
+    def set_colour(self, widget, colour):
+        '''Queue a foreground colour change if it differs from the rendered colour'''
+        if self._colours.get(widget) == colour:
+            self.total_skipped += 1
+            return
+        self._colours[widget] = colour
+        self._pending.append((widget.SetForegroundColour, wx.Colour(colour)))
+
+    def render(self):
+        '''Apply the queued changes in a single repaint'''
+        self.widgets_updated = len(self._pending)
+        self.total_updated += self.widgets_updated
+        if not self._pending:
+            return
+
+        self.frame.Freeze()
+        try:
+            for setter, value in self._pending:
+                setter(value)
+        finally:
+            self.frame.Thaw()
+        self._pending.clear()
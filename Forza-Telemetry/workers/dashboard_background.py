@@ -1,34 +1,40 @@
 import os
-import socket
 import sys
 
 # Add the parent directory to our path
 sys.path.append(os.path.abspath('..'))
 
 from util.data_packet import DataPacket
+from util.latency import LatencyStats
+from util.receiver import BatchReceiver
+from util.ring_buffer import LatestPacketSlot, PacketRingBuffer
 
-# Handles the execution of receiving/parsing to leave
+# Handles the execution of receiving packets to leave
 # the wx process unblocked
-def worker(dashboard_data, game_version, host, port):
-    # Create an ipv4 datagram-based socket and bind
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind((host, port))
+def worker(ring_name, game_version, host, port, coalesce = False, latency_name = None):
+    # Create a batched ipv4 datagram receiver
+    receiver = BatchReceiver(host, port)
 
-    # Instantiate class and variables
+    # Instantiate class and attach to the shared ring buffer (or
+    # the latest packet slot if only the newest packet is needed)
     dp = DataPacket(version=game_version)
+    ring = LatestPacketSlot(ring_name) if coalesce else PacketRingBuffer(ring_name)
+
+    # Attach to the shared latency statistics if enabled
+    latency = LatencyStats(latency_name) if latency_name else None
 
     # Loop indefinitely until finished
     while True:
-        # Receive a data packet from Forza
-        packet, _ = sock.recvfrom(1024)
-
-        # Parse this packet
-        dp.parse(packet)
+        # Receive every pending data packet from Forza
+        batch = receiver.receive()
+        for packet, received in zip(batch, receiver.received):
+            # Validate this packet, the dashboard parses it when read
+            dp._validate(packet)
 
-        # Update the shared dict of values - we cannot just
-        # re-assign here as it won't detect the change
-        for k, v in dp.to_dict().items():
-            dashboard_data[k] = v
+            # Publish the raw packet to the dashboard with the time it was received
+            ring.write(packet, received)
+            if latency is not None:
+                latency.record('handoff', received)
 
     # If the loop exits, close the socket if necessary
-    sock.close()
+    receiver.close()
@@ -0,0 +1,78 @@
+import heapq
+import os
+import socket
+import sys
+from time import perf_counter_ns
+
+# Add the parent directory to our path
+sys.path.append(os.path.abspath('..'))
+
+from util.histogram import LatencyHistogram
+from util.packet_cache import PacketCache
+from util.scheduler import sleep_until
+
+# Sends recordings to a set of targets, each at its own rate (or as fast
+# as possible when the rate is 0), and reports the results when finished
+def sender(targets, game_version, duration, cache_dir, results):
+    # Create an ipv4 datagram-based socket shared by every target
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    # Prepare each recording once, even if used by several targets
+    caches = {}
+    for _, _, input_file, _ in targets:
+        if input_file not in caches:
+            caches[input_file] = PacketCache(input_file, game_version, cache_dir)
+
+    # Per-target state: address, packet buffer, offset, period and counters
+    state = []
+    for host, port, input_file, rate_ms in targets:
+        cache = caches[input_file]
+        state.append({
+            'address': (host, port),
+            'buffer': memoryview(cache.buffer),
+            'size': cache.packet_size,
+            'offset': 0,
+            'period': rate_ms * 1e6,
+            'sent': 0,
+            'dropped': 0,
+        })
+    histogram = LatencyHistogram()
+
+    # Schedule every target on its own absolute deadlines
+    start = perf_counter_ns()
+    end = start + int(duration * 1e9)
+    queue = [(start, i, 0) for i in range(len(state))]
+    heapq.heapify(queue)
+
+    while True:
+        deadline, i, count = heapq.heappop(queue)
+        if deadline >= end:
+            break
+        sleep_until(deadline)
+        target = state[i]
+
+        # Send the next packet, looping the recording
+        size = target['size']
+        packet = target['buffer'][target['offset']:target['offset'] + size]
+        sent_at = perf_counter_ns()
+        try:
+            sock.sendto(packet, target['address'])
+            target['sent'] += 1
+        except OSError:
+            target['dropped'] += 1
+        histogram.record(perf_counter_ns() - sent_at)
+        target['offset'] = (target['offset'] + size) % len(target['buffer'])
+
+        # Targets without a rate are sent to as fast as possible
+        next_deadline = start + round((count + 1) * target['period']) if target['period'] else perf_counter_ns()
+        heapq.heappush(queue, (next_deadline, i, count + 1))
+
+    elapsed = (perf_counter_ns() - start) / 1e9
+    sock.close()
+    results.put({
+        'targets': [
+            (f"{t['address'][0]}:{t['address'][1]}", t['sent'], t['dropped'], elapsed)
+            for t in state
+        ],
+        'histogram': histogram.tobytes(),
+    })
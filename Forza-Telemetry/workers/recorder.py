@@ -1,32 +1,52 @@
 import os
-import socket
 import sys
 
 # Add the parent directory to our path
 sys.path.append(os.path.abspath('..'))
 
 from util.data_packet import DataPacket
+from util.receiver import BatchReceiver
+from util.recording import RecordingWriter
+from util.ring_buffer import PacketRingBuffer
 
-# Handles the execution of receiving/parsing to leave
+# Handles the execution of receiving packets to leave
 # the main process unblocked
-def worker(packets, game_version, host, port):
-    # Create an ipv4 datagram-based socket and bind
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.bind((host, port))
+def worker(ring_name, game_version, host, port):
+    # Create a batched ipv4 datagram receiver
+    receiver = BatchReceiver(host, port)
 
-    # Instantiate class and variables
+    # Instantiate class and attach to the shared ring buffer
     dp = DataPacket(version=game_version)
+    ring = PacketRingBuffer(ring_name)
 
     # Loop indefinitely until finished
     while True:
-        # Receive a data packet from Forza
-        packet, _ = sock.recvfrom(1024)
+        # Receive every pending data packet from Forza
+        for packet in receiver.receive():
+            # Validate this packet, values are decoded by the reader
+            dp._validate(packet)
 
-        # Parse this packet, however, don't convert values
-        dp.parse(packet, recording = True)
-
-        # Append this packet to the shared list
-        packets.append(dp.to_dict().values())
+            # Publish the raw packet to every reader of the ring buffer
+            ring.write(packet)
 
     # If the loop exits, close the socket if necessary
-    sock.close()
\ No newline at end of file
+    receiver.close()
+
+# Streams packets into a binary recording until the stop event is set
+def stream_worker(file_path, stop_event, game_version, host, port):
+    # Create a batched ipv4 datagram receiver, waking up
+    # periodically so we can check if we should stop
+    receiver = BatchReceiver(host, port, timeout=0.25)
+
+    # Write each packet straight to disk so memory usage stays constant
+    with RecordingWriter(file_path, version=game_version) as writer:
+        while not stop_event.is_set():
+            for packet in receiver.receive():
+                writer.write(packet)
+
+    receiver.close()
+    stats = receiver.stats
+    print(
+        f"Received {stats['packets']:,} packets in {stats['batches']:,} batches "
+        f"(max batch {stats['max_batch']}), {stats['kernel_drops']:,} dropped by the kernel"
+    )